@@ -1,90 +1,19 @@
 from llama_index.core import Settings, Document
-from llama_index.core.node_parser import SentenceSplitter
-from llama_index.core.vector_stores import SimpleVectorStore
-from llama_index.core.storage import StorageContext
-from llama_index.core.indices.vector_store import VectorStoreIndex
 from llama_index.core.callbacks import CallbackManager, LlamaDebugHandler
 from llama_index.llms.openai import OpenAI
-from llama_index.readers.web import SimpleWebPageReader
-from typing import List, Dict, Optional
-import json
+from aiolimiter import AsyncLimiter
+from selectolax.lexbor import LexborHTMLParser
+from typing import List, Dict, Optional, Tuple
+import asyncio
+import httpx
+import orjson
+import tiktoken
 import os
-import hashlib
-import time
 from datetime import datetime
-from .utils import setup_logging
+from .cache import AnalysisCache, CachedEmbedding, SemanticCache
+from .utils import setup_logging, truncate_text, url_hash, read_json, write_json, StreamingJsonParser
 
-class Beagle:
-    def __init__(self, school: str, importance_ranking_path: str):
-        self.school = school
-        
-        # Setup LlamaIndex components
-        self.llama_debug = LlamaDebugHandler()
-        callback_manager = CallbackManager([self.llama_debug])
-        
-        # Use GPT-4o for deeper analysis
-        Settings.llm = OpenAI(
-            model="gpt-4o",
-            temperature=0,
-            api_version="2024-02"
-        )
-        Settings.callback_manager = callback_manager
-        
-        # Initialize node parser
-        self.node_parser = SentenceSplitter(chunk_size=1024, chunk_overlap=20)
-        
-        # Initialize web page reader
-        self.reader = SimpleWebPageReader()
-        
-        # Load pages to analyze
-        with open(importance_ranking_path) as f:
-            data = json.load(f)
-            self.pages_to_analyze = data.get('ranking', [])
-            
-        self.logger = setup_logging(school, "beagle")
-        os.makedirs(f"{school}/analysis", exist_ok=True)
-
-    def capture_page(self, url: str) -> Optional[Document]:
-        try:
-            # Use LlamaIndex's web page reader
-            documents = self.reader.load_data([url])
-            
-            if not documents:
-                return None
-                
-            # Process document with HTML parser
-            nodes = self.node_parser.get_nodes_from_documents(documents)
-            
-            # Create temporary index for this page
-            storage_context = StorageContext.from_defaults()
-            index = VectorStoreIndex(
-                nodes,
-                storage_context=storage_context,
-                verbose=True
-            )
-            
-            return documents[0]
-            
-        except Exception as e:
-            self.logger.error(f"Failed to capture {url}: {str(e)}")
-            return None
-
-    def analyze_page(self, document: Document) -> Optional[Dict]:
-        try:
-            # Check and limit content length
-            content = document.text
-            estimated_tokens = len(content) / 4
-            if estimated_tokens > 6000:
-                self.logger.info(f"Large content detected ({estimated_tokens:.0f} estimated tokens). Limiting to ~6000 tokens.")
-                content = content[:24000]  # 24000 chars ≈ 6000 tokens
-            
-            # Use LlamaIndex's query engine for content analysis
-            query_engine = VectorStoreIndex([Document(text=content)]).as_query_engine(
-                verbose=True
-            )
-            
-            # Create analysis prompt
-            prompt = f"""You are a pre-med advisor analyzing medical school program content. Your task is to extract and structure the content following these rules:
+_ANALYSIS_PROMPT = """You are a pre-med advisor analyzing medical school program content. Your task is to extract and structure the content following these rules:
 
 CONTENT ANALYSIS:
 1. Find and preserve ALL valuable content including:
@@ -149,56 +78,295 @@ JSON OUTPUT RULES:
    - Escape special characters
 
 3. Output Format (REQUIRED - return ONLY this JSON structure with no additional text):
-   {{
+   {
      "sections": [
-       {{
+       {
          "text": "content here (max 1000 chars)",
          "type": "category name",
          "context": "brief context"
-       }}
+       }
      ],
-     "program_info": {{
+     "program_info": {
        "key_points": ["point1", "point2"],
        "requirements": ["req1", "req2"]
-     }}
-   }}
+     }
+   }
+"""
 
-Content to analyze:
-{document.text[:2000]}
-            """
+# Strict structured output: the model emits exactly these keys, nothing more
+_ANALYSIS_SCHEMA = {
+    "name": "page_analysis",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "sections": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "text": {"type": "string"},
+                        "type": {"type": "string"},
+                        "context": {"type": "string"}
+                    },
+                    "required": ["text", "type", "context"],
+                    "additionalProperties": False
+                }
+            },
+            "program_info": {
+                "type": "object",
+                "properties": {
+                    "key_points": {"type": "array", "items": {"type": "string"}},
+                    "requirements": {"type": "array", "items": {"type": "string"}}
+                },
+                "required": ["key_points", "requirements"],
+                "additionalProperties": False
+            }
+        },
+        "required": ["sections", "program_info"],
+        "additionalProperties": False
+    }
+}
+
+class Beagle:
+    def __init__(self, school: str, importance_ranking_path: str):
+        self.school = school
+        
+        # Setup LlamaIndex components
+        self.llama_debug = LlamaDebugHandler()
+        callback_manager = CallbackManager([self.llama_debug])
+        
+        # Use GPT-4o for deeper analysis; concurrent calls share pooled
+        # HTTP/2 connections instead of each opening its own TLS session
+        api_limits = httpx.Limits(max_keepalive_connections=32, max_connections=32)
+        api_timeout = httpx.Timeout(60.0, connect=5.0)
+        self.llm = OpenAI(
+            model="gpt-4o",
+            temperature=0,
+            api_version="2024-02",
+            # Schema-constrained output guarantees a bare, parseable object
+            # (no markdown fences) with no extra keys to generate
+            additional_kwargs={"response_format": {"type": "json_schema", "json_schema": _ANALYSIS_SCHEMA}},
+            http_client=httpx.Client(http2=True, limits=api_limits, timeout=api_timeout),
+            async_http_client=httpx.AsyncClient(http2=True, limits=api_limits, timeout=api_timeout)
+        )
+        Settings.llm = self.llm
+        Settings.callback_manager = callback_manager
+        
+        # Concurrency and rate limiting: token buckets sized to the target
+        # site and to OpenAI's request limit replace fixed sleeps
+        self.MAX_CONCURRENCY = 5
+        self.scrape_limiter = AsyncLimiter(10, 1)  # 10 page fetches per second
+        self.llm_limiter = AsyncLimiter(500, 60)  # 500 LLM requests per minute
+        
+        # HTTP client settings shared by the sync and async capture paths
+        self._http_options = {
+            "http2": True,
+            "timeout": 30,
+            "follow_redirects": True,
+            "headers": {"User-Agent": "medex/0.1"}
+        }
+        self._http = None
+        
+        # Tokenizer for capping page content at a real token budget
+        self.MAX_CONTENT_TOKENS = 6000
+        self.MAX_PROMPT_CHARS = 2000  # Page text quoted in the analysis prompt
+        self._enc = tiktoken.encoding_for_model("gpt-4o")
+        
+        # Load pages to analyze
+        data = read_json(importance_ranking_path)
+        ranking = data.get('ranking', [])
+        # Drop malformed and repeated entries so each URL costs one analysis
+        seen = set()
+        self.pages_to_analyze = []
+        for page in ranking:
+            if not isinstance(page, dict) or not isinstance(page.get('url'), str):
+                continue
+            if page['url'] in seen:
+                continue
+            seen.add(page['url'])
+            self.pages_to_analyze.append(page)
+        # Output paths are fixed per URL; hash them once up front
+        self._filename_by_url = {
+            page['url']: f"{school}/analysis/{url_hash(page['url'])}.json"
+            for page in self.pages_to_analyze
+        }
+            
+        self.logger = setup_logging(school, "beagle")
+        dropped = len(ranking) - len(self.pages_to_analyze)
+        if dropped:
+            self.logger.info(f"Dropped {dropped} duplicate or malformed ranking entries")
+        os.makedirs(f"{school}/analysis", exist_ok=True)
+        # Unchanged text is embedded from the on-disk cache, not the API
+        if not isinstance(Settings.embed_model, CachedEmbedding):
+            Settings.embed_model = CachedEmbedding(Settings.embed_model, f"{school}/embedding_cache.sqlite")
+        
+        # Analyses are deterministic (temperature=0), so cache them by content
+        self.cache = AnalysisCache(f"{school}/analysis/.cache")
+        # A page whose text changed only slightly since it was last analyzed
+        # (a date, a banner) reuses that analysis. Hits are scoped to the same
+        # URL: sibling pages on one site embed close together, and serving
+        # another page's extracted sections would corrupt this page's output.
+        # One store per model/prompt/embedder combination, like the exact key
+        semantic_namespace = AnalysisCache.key(
+            self.llm.model, _ANALYSIS_PROMPT, Settings.embed_model.model_name
+        )[:16]
+        self.semantic_cache = SemanticCache(f"{school}/analysis/.semcache/{semantic_namespace}", threshold=0.98)
+
+    def _new_http_client(self) -> httpx.AsyncClient:
+        """HTTP/2 client whose keep-alive pool is shared by every page fetch"""
+        return httpx.AsyncClient(**self._http_options)
+
+    def _page_document(self, url: str, html: str) -> Optional[Document]:
+        # Parse once with lexbor and keep only the visible page content;
+        # chrome and hidden nodes would otherwise fill the prompt excerpt
+        tree = LexborHTMLParser(html)
+        tree.strip_tags(["script", "style", "noscript", "template", "svg",
+                         "iframe", "nav", "footer", "aside"])
+        # strip_tags drops whole subtrees, so <form> (ASP.NET/SharePoint wrap
+        # the entire page in one) and article <header>s (title, first section)
+        # stay; only the top-level site banner goes
+        for node in tree.css('[hidden], [aria-hidden="true"], body > header, [role="banner"]'):
+            node.decompose()
+        title = tree.css_first("title")
+        text = tree.body.text(separator=" ", strip=True) if tree.body else ""
+        if not text:
+            return None
             
-            # Use query engine for analysis
-            response = query_engine.query(prompt)
-            response_text = str(response)
+        return Document(
+            text=text,
+            metadata={"url": url, "title": title.text(strip=True) if title else ""}
+        )
+
+    async def acapture_page(self, url: str, client: Optional[httpx.AsyncClient] = None) -> Optional[Document]:
+        if client is None:
+            async with self._new_http_client() as client:
+                return await self.acapture_page(url, client)
+        try:
+            response = await client.get(url)
+            response.raise_for_status()
+            return self._page_document(url, response.text)
+            
+        except Exception as e:
+            self.logger.error(f"Failed to capture {url}: {str(e)}")
+            return None
+
+    def capture_page(self, url: str) -> Optional[Document]:
+        """Synchronous capture that reuses one lazily created client across calls"""
+        if self._http is None:
+            self._http = httpx.Client(**self._http_options)
+        try:
+            response = self._http.get(url)
+            response.raise_for_status()
+            return self._page_document(url, response.text)
+            
+        except Exception as e:
+            self.logger.error(f"Failed to capture {url}: {str(e)}")
+            return None
+
+    def close(self):
+        """Release the connection pool held by capture_page"""
+        if self._http is not None:
+            self._http.close()
+            self._http = None
+
+    def _limit_tokens(self, text: str) -> str:
+        """Truncate text to MAX_CONTENT_TOKENS on a token boundary"""
+        tokens = self._enc.encode(text, disallowed_special=())
+        if len(tokens) <= self.MAX_CONTENT_TOKENS:
+            return text
+        return self._enc.decode(tokens[:self.MAX_CONTENT_TOKENS])
+
+    def _cache_key(self, text: str) -> str:
+        # The prompt template is part of the key so editing it invalidates old entries.
+        # Takes the already token-capped text so callers tokenize each page once.
+        return AnalysisCache.key(self.llm.model, _ANALYSIS_PROMPT, self.school, text)
+
+    def embed_documents(self, documents: List[Document]) -> Tuple[List[str], List[Optional[List[float]]]]:
+        """Cap every document's text once, then embed, in batched API calls,
+        every document the exact cache can't answer. Returns both so callers
+        can hand the capped text on to analyze_page."""
+        texts = [self._limit_tokens(document.text) for document in documents]
+        embeddings = [None] * len(documents)
+        pending = [
+            i for i, text in enumerate(texts)
+            if self.cache.get(self._cache_key(text)) is None
+        ]
+        if not pending:
+            return texts, embeddings
+        try:
+            vectors = Settings.embed_model.get_text_embedding_batch(
+                [texts[i] for i in pending],
+                show_progress=False
+            )
+        except Exception as e:
+            self.logger.error(f"Batch embedding failed, falling back to per-page: {str(e)}")
+            return texts, embeddings
+        for i, vector in zip(pending, vectors):
+            embeddings[i] = vector
+        return texts, embeddings
+
+    def analyze_page(self, document: Document, embedding: Optional[List[float]] = None,
+                     text: Optional[str] = None) -> Optional[Dict]:
+        if text is None:
+            text = self._limit_tokens(document.text)
+        cache_key = self._cache_key(text)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            self.logger.info(f"Cache hit for {document.metadata.get('url', '')}")
+            return cached
+            
+        try:
+            if embedding is None:
+                embedding = Settings.embed_model.get_text_embedding(text)
+            cached = self.semantic_cache.get(embedding, scope=document.metadata.get("url"))
+            if cached is not None:
+                self.logger.info(f"Semantic cache hit for {document.metadata.get('url', '')}")
+                return cached
+            
+            # Static instructions come first so the prefix is identical
+            # across pages and eligible for OpenAI prompt caching
+            prompt = _ANALYSIS_PROMPT + f"\n\nSchool: {self.school}\nContent to analyze:\n{truncate_text(document.text, self.MAX_PROMPT_CHARS)}"
+            
+            # The prompt carries the page content itself, so call the LLM
+            # directly rather than paying for an embed + retrieve round-trip.
+            # Stream the completion so malformed output is rejected on the
+            # first tokens and trailing tokens after the object are skipped.
+            parser = StreamingJsonParser()
+            stream = self.llm.stream_complete(prompt)
+            try:
+                for chunk in stream:
+                    if parser.consume(chunk.delta or ""):
+                        break
+            except ValueError as e:
+                self.logger.error(f"Malformed response stream: {str(e)}")
+                return None
+            finally:
+                stream.close()
+            response_text = parser.text
             
             try:
                 # Log the response for debugging
                 self.logger.info(f"Raw response: {response_text[:200]}...")
                 
-                # Clean up the response text
                 if response_text.strip():
-                    # Remove markdown code blocks if present
-                    if "```" in response_text:
-                        # Split by ``` and take the content between the markers
-                        parts = response_text.split("```")
-                        if len(parts) >= 2:
-                            response_text = parts[1]
-                            # Remove "json" if it's at the start
-                            if response_text.startswith("json"):
-                                response_text = response_text[4:]
-                            # Remove any trailing ```
-                            response_text = response_text.split("```")[0]
+                    if not parser.complete:
+                        self.logger.error("Response stream ended before the JSON object closed")
+                        self.logger.error(f"Full response: {response_text}")
+                        return None
                     
                     try:
                         # Try to parse as JSON
-                        result = json.loads(response_text.strip())
+                        result = orjson.loads(response_text.strip())
                         # Validate expected structure
                         if "sections" not in result:
                             self.logger.error("Missing required 'sections' in response")
                             self.logger.error(f"Full response: {response_text}")
                             return None
+                        self.cache.put(cache_key, result)
+                        self.semantic_cache.put(embedding, result, scope=document.metadata.get("url"))
                         return result
-                    except json.JSONDecodeError as e:
+                    except orjson.JSONDecodeError as e:
                         self.logger.error(f"JSON parse error at position {e.pos}: {str(e)}")
                         self.logger.error(f"Error context: {response_text[max(0, e.pos-50):min(len(response_text), e.pos+50)]}")
                         self.logger.error(f"Full response: {response_text}")
@@ -228,31 +396,67 @@ Content to analyze:
                     "type": section['type'],
                     "context": section['context'],
                     "advisor_notes": section.get('advisor_notes', ''),
-                    "url": document.metadata.get("url", ""),
-                    "source": document.metadata
+                    "url": document.metadata.get("url", "")
                 }
             )
             nodes.append(node)
         return nodes
 
     def analyze(self):
-        for page in self.pages_to_analyze:
+        asyncio.run(self.aanalyze())
+
+    async def aanalyze(self):
+        """Analyze all ranked pages concurrently, bounded by MAX_CONCURRENCY"""
+        sem = asyncio.Semaphore(self.MAX_CONCURRENCY)
+        async with self._new_http_client() as client:
+            documents = await asyncio.gather(*[
+                self._capture_one(page, client, sem) for page in self.pages_to_analyze
+            ])
+        captured = [
+            (page, document)
+            for page, document in zip(self.pages_to_analyze, documents)
+            if document
+        ]
+        
+        # One batched embeddings pass instead of a round-trip per page
+        texts, embeddings = await asyncio.to_thread(
+            self.embed_documents, [document for _, document in captured]
+        )
+        
+        await asyncio.gather(*[
+            self._process_one(page, document, embedding, text, sem)
+            for (page, document), embedding, text in zip(captured, embeddings, texts)
+        ])
+
+    async def _capture_one(self, page: Dict, client: httpx.AsyncClient,
+                           sem: asyncio.Semaphore) -> Optional[Document]:
+        async with sem:
+            try:
+                self.logger.info(f"Capturing {page['url']}")
+                async with self.scrape_limiter:
+                    return await self.acapture_page(page['url'], client)
+            except Exception as e:
+                self.logger.error(f"Error capturing {page.get('url', '')}: {str(e)}")
+                return None
+
+    async def _process_one(self, page: Dict, document: Document,
+                           embedding: Optional[List[float]], text: str,
+                           sem: asyncio.Semaphore):
+        async with sem:
             try:
                 url = page['url']
                 self.logger.info(f"Analyzing {url}")
                 
-                document = self.capture_page(url)
-                if not document:
-                    continue
-                    
-                analysis = self.analyze_page(document)
+                async with self.llm_limiter:
+                    analysis = await asyncio.to_thread(self.analyze_page, document, embedding, text)
                 if not analysis:
-                    continue
+                    return
                     
                 nodes = self.prepare_nodes(analysis, document)
                 
                 output = {
                     "url": url,
+                    "document_metadata": document.metadata,
                     "analysis": analysis,
                     "nodes": [
                         {
@@ -263,12 +467,8 @@ Content to analyze:
                     "timestamp": datetime.now().isoformat()
                 }
                 
-                filename = f"{self.school}/analysis/{hashlib.md5(url.encode()).hexdigest()}.json"
-                with open(filename, 'w') as f:
-                    json.dump(output, f, indent=2)
-                    
-                time.sleep(1)  # Rate limiting
+                filename = self._filename_by_url[url]
+                await asyncio.to_thread(write_json, filename, output)
                 
             except Exception as e:
                 self.logger.error(f"Error processing {page['url']}: {str(e)}")
-                continue
@@ -0,0 +1,285 @@
+import hashlib
+import orjson
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+
+class AnalysisCache:
+    """On-disk cache of LLM analyses keyed by a BLAKE2b hash of their inputs.
+
+    Entries are stored as one JSON file per key and written atomically so
+    concurrent workers never observe a partial file. An in-process dict sits
+    in front of the filesystem so repeats within a run skip disk entirely.
+    Entries older than ``ttl`` seconds (if given) are treated as misses.
+    """
+
+    def __init__(self, cache_dir: str, ttl: Optional[float] = None):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        os.makedirs(cache_dir, exist_ok=True)
+        self._memo: Dict[str, Dict] = {}
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        digest = hashlib.blake2b(digest_size=32)
+        for part in parts:
+            digest.update(part.encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict]:
+        if key in self._memo:
+            return self._memo[key]
+        path = self._path(key)
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, 'rb') as f:
+                value = orjson.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        self._memo[key] = value
+        return value
+
+    def put(self, key: str, value: Dict):
+        self._memo[key] = value
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(orjson.dumps(value))
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+class SemanticCache:
+    """Embedding-similarity cache for analyses of near-duplicate pages.
+
+    Embeddings are L2-normalised on insert so a single matrix-vector product
+    yields cosine similarity against every stored entry. In memory they are
+    scalar-quantized to int8 (a quarter of the float32 footprint); the error
+    this adds to a cosine score is far below the match threshold's margin.
+    Entries are appended to a JSONL file under cache_dir and reloaded on
+    startup. Entries older than ``ttl`` seconds (if given) never match, and
+    an entry put with a ``scope`` only matches lookups with that same scope.
+    """
+
+    _SCALE = 127
+
+    def __init__(self, cache_dir: str, threshold: float = 0.93, ttl: Optional[float] = None):
+        self.cache_dir = cache_dir
+        self.threshold = threshold
+        self.ttl = ttl
+        os.makedirs(cache_dir, exist_ok=True)
+        self._path = os.path.join(cache_dir, "entries.jsonl")
+        self._lock = threading.Lock()
+        self._values: List[Dict] = []
+        self._created: List[float] = []
+        self._scopes: List[Optional[str]] = []
+        self._matrix = None
+        if os.path.exists(self._path):
+            vectors = []
+            with open(self._path, 'rb') as f:
+                for line in f:
+                    entry = orjson.loads(line)
+                    vectors.append(entry["embedding"])
+                    self._values.append(entry["analysis"])
+                    self._created.append(entry.get("created", 0.0))
+                    self._scopes.append(entry.get("scope"))
+            if vectors:
+                self._matrix = self._quantize(np.asarray(vectors, dtype=np.float32))
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @classmethod
+    def _quantize(cls, vectors: np.ndarray) -> np.ndarray:
+        return np.round(vectors * cls._SCALE).astype(np.int8)
+
+    def get(self, embedding: List[float], scope: Optional[str] = None) -> Optional[Dict]:
+        matrix = self._matrix
+        if matrix is None:
+            return None
+        scores = (matrix @ self._normalize(embedding)) / self._SCALE
+        if self.ttl is not None:
+            cutoff = time.time() - self.ttl
+            expired = np.asarray(self._created[:len(scores)]) < cutoff
+            scores = np.where(expired, -1.0, scores)
+        other_scope = np.fromiter((s != scope for s in self._scopes[:len(scores)]), dtype=bool, count=len(scores))
+        scores = np.where(other_scope, -1.0, scores)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        return self._values[best]
+
+    def put(self, embedding: List[float], value: Dict, scope: Optional[str] = None):
+        vector = self._normalize(embedding)
+        created = time.time()
+        with self._lock:
+            self._values.append(value)
+            self._created.append(created)
+            self._scopes.append(scope)
+            row = self._quantize(vector[np.newaxis, :])
+            if self._matrix is None:
+                self._matrix = row
+            else:
+                self._matrix = np.vstack([self._matrix, row])
+            with open(self._path, 'ab') as f:
+                f.write(orjson.dumps({"embedding": vector, "analysis": value, "created": created, "scope": scope},
+                                     option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE))
+
+
+class MinHashIndex:
+    """In-memory near-duplicate detector over word shingles.
+
+    Each text is reduced to a MinHash signature: the minima of num_perm
+    random affine hashes over its lowercase word shingles. The fraction of
+    positions where two signatures agree estimates the Jaccard similarity of
+    their shingle sets, and a new signature is compared against every
+    stored one in a single vectorized pass.
+
+    Texts with fewer shingles than shingle_size (empty pages, redirect stubs,
+    JS-only shells) get no signature: they would all collapse onto the same
+    few shingles and match each other, so they are never looked up or stored.
+    """
+
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, threshold: float = 0.9, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # Coefficients below 2**31 keep a * hash + b inside uint64
+        self._a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._lock = threading.Lock()
+        self._values: List[Dict] = []
+        self._matrix = None
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        words = text.lower().split()
+        n = self.shingle_size
+        shingles = {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+        if len(shingles) < n:
+            return None
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") for s in shingles),
+            dtype=np.uint64,
+            count=len(shingles)
+        )
+        return ((np.outer(hashes, self._a) + self._b) % np.uint64(self._PRIME)).min(axis=0)
+
+    def get(self, signature: Optional[np.ndarray]) -> Optional[Dict]:
+        matrix = self._matrix
+        if matrix is None or signature is None:
+            return None
+        similarity = (matrix == signature).mean(axis=1)
+        best = int(np.argmax(similarity))
+        if similarity[best] < self.threshold:
+            return None
+        return self._values[best]
+
+    def put(self, signature: Optional[np.ndarray], value: Dict):
+        if signature is None:
+            return
+        with self._lock:
+            self._values.append(value)
+            if self._matrix is None:
+                self._matrix = signature[np.newaxis, :]
+            else:
+                self._matrix = np.vstack([self._matrix, signature])
+
+
+class CachedEmbedding(BaseEmbedding):
+    """Embedding model wrapper that memoizes text vectors on disk.
+
+    Vectors are keyed by (BLAKE2b hash of the text, model name) in a SQLite table
+    and stored as raw float32 bytes. Each batch is looked up in one query and
+    only the misses reach the wrapped model, in a single batched call.
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _db: sqlite3.Connection = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, path: str, **kwargs):
+        super().__init__(
+            model_name=inner.model_name,
+            embed_batch_size=inner.embed_batch_size,
+            **kwargs
+        )
+        self._inner = inner
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache "
+            "(hash TEXT, model TEXT, vec BLOB, PRIMARY KEY (hash, model))"
+        )
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def _lookup(self, texts: List[str]):
+        hashes = [hashlib.blake2b(text.encode(), digest_size=32).hexdigest() for text in texts]
+        placeholders = ",".join("?" * len(hashes))
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT hash, vec FROM embedding_cache WHERE model = ? AND hash IN ({placeholders})",
+                [self.model_name, *hashes]
+            ).fetchall()
+        found = {h: np.frombuffer(vec, dtype=np.float32).tolist() for h, vec in rows}
+        return hashes, [found.get(h) for h in hashes]
+
+    def _store(self, hashes: List[str], vectors: List[Optional[List[float]]],
+               missing: List[int], fresh: List[List[float]]):
+        for i, vector in zip(missing, fresh):
+            vectors[i] = vector
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embedding_cache VALUES (?, ?, ?)",
+                [(hashes[i], self.model_name, np.asarray(vectors[i], dtype=np.float32).tobytes())
+                 for i in missing]
+            )
+            self._db.commit()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._inner.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._inner.aget_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        hashes, vectors = self._lookup(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            fresh = self._inner.get_text_embedding_batch([texts[i] for i in missing])
+            self._store(hashes, vectors, missing, fresh)
+        return vectors
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        hashes, vectors = self._lookup(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            fresh = await self._inner.aget_text_embedding_batch([texts[i] for i in missing])
+            self._store(hashes, vectors, missing, fresh)
+        return vectors
@@ -4,100 +4,37 @@ from llama_index.core.vector_stores import SimpleVectorStore
 from llama_index.core.storage import StorageContext
 from llama_index.core.indices.vector_store import VectorStoreIndex
 from llama_index.core.callbacks import CallbackManager, LlamaDebugHandler
+from llama_index.core.llms import ChatMessage, MessageRole
 from llama_index.llms.openai import OpenAI
-from llama_index.readers.web import AsyncWebPageReader
+from aiolimiter import AsyncLimiter
 import asyncio
+import contextlib
+import functools
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import numpy as np
+from selectolax.lexbor import LexborHTMLParser
 from typing import Dict, List, Optional
-from urllib.parse import urlparse
-import json
+from urllib.parse import parse_qsl, urldefrag, urlencode, urljoin, urlsplit, urlunsplit
+import orjson
+import tiktoken
 from datetime import datetime
 import os
-import hashlib
-from .utils import setup_logging
+import re
+from .cache import AnalysisCache, CachedEmbedding, MinHashIndex, SemanticCache
+from .utils import setup_logging, truncate_text, url_hash, write_json, StreamingJsonParser
 
 # Configure LlamaIndex settings
 Settings.chunk_size = 1024
 Settings.chunk_overlap = 20
 Settings.num_output = 512  # Limit response length for efficiency
 
-class Explorer:
-    def __init__(self, school: str, start_url: str):
-        self.school = school
-        self.start_url = start_url
-        self.base_domain = urlparse(start_url).netloc
-        self.page_importance = {}
-        # Setup LlamaIndex debug handler
-        self.llama_debug = LlamaDebugHandler()
-        callback_manager = CallbackManager([self.llama_debug])
-        
-        # Setup LlamaIndex settings with GPT-4o-mini
-        Settings.llm = OpenAI(
-            model="gpt-4o-mini",
-            temperature=0.1,
-            api_version="2024-02"
-        )
-        Settings.callback_manager = callback_manager
-        
-        self.MAX_PAGES = 500
-        
-        # LlamaIndex setup for web page reading with async support
-        self.loader = AsyncWebPageReader(
-            html_to_text=True,  # Convert HTML to clean text for better parsing
-            limit=5,  # Limit concurrent requests to be respectful
-            dedupe=True,  # Remove duplicate URLs
-            fail_on_error=False  # Continue on errors to be resilient
-        )
-        
-        # Setup node parser with default configuration
-        self.node_parser = SentenceSplitter(chunk_size=1024, chunk_overlap=20)
-        
-        # Setup storage
-        self.storage_dir = f"{school}/index_storage"
-        os.makedirs(self.storage_dir, exist_ok=True)
-        
-        # Create new storage context
-        self.storage_context = StorageContext.from_defaults()
-        
-        self.logger = setup_logging(school, "explorer")
-        os.makedirs(f"{school}/pages", exist_ok=True)
-        
-    def fetch_pages(self) -> List[Document]:
-        try:
-            # Load documents with async support
-            documents = asyncio.run(self.loader.aload_data(urls=[self.start_url]))
-            for doc in documents:
-                if not doc.metadata:
-                    doc.metadata = {}
-                doc.metadata["url"] = self.start_url
-            self.logger.info(f"Loaded {len(documents)} documents")
-            
-            # Process documents into nodes
-            nodes = self.node_parser.get_nodes_from_documents(documents)
-            self.logger.info(f"Created {len(nodes)} nodes")
-            
-            # Create and persist vector index
-            self.index = VectorStoreIndex(
-                nodes,
-                storage_context=self.storage_context
-            )
-            # Persist storage after indexing
-            self.index.storage_context.persist(persist_dir=self.storage_dir)
-            
-            return documents
-            
-        except Exception as e:
-            self.logger.error(f"Error fetching pages: {str(e)}")
-            return []
+# Completion cap per analyzed page: room for a full analysis with its bounded
+# link list. A module constant, since medex and its CLI reset num_output
+_MAX_OUTPUT_TOKENS = 1024
 
-    def analyze_page(self, document: Document) -> dict:
-        
-        try:
-            # Create analysis prompt
-            # Log the raw content for debugging
-            self.logger.info(f"Raw content length: {len(document.text)}")
-            self.logger.info(f"Content sample: {document.text[:500]}")
-            
-            prompt = f"""You are an experienced pre-med advisor analyzing a medical school webpage. Your task is to discover ALL content paths valuable to pre-med students by thinking like an advisor who has reviewed hundreds of medical school websites.
+_ANALYSIS_PROMPT = """You are an experienced pre-med advisor analyzing a medical school webpage. Your task is to discover ALL content paths valuable to pre-med students by thinking like an advisor who has reviewed hundreds of medical school websites.
 
 CRITICAL: Your primary task is to discover ALL possible navigation paths and content references. You must:
 1. Identify explicit links in the content (URLs, paths)
@@ -145,24 +82,25 @@ CONTENT PRIORITIES:
    - Decision-critical content
 
 Return a JSON object with these EXACT keys and format (no additional text):
-{{
+{
     "importance_score": 0.9,
     "explorer_tags": ["admissions", "requirements"],
     "abstract": "Brief summary of the page content",
     "recommended_links": [
-        {{
+        {
             "url": "/admissions/requirements.html",
             "text": "Admissions Requirements",
             "type": "navigation",
             "priority": 0.9,
             "source": "Main Navigation Menu",
             "confidence": 1.0
-        }}
+        }
     ],
     "related_topics": ["admissions process", "requirements"]
-}}
+}
 
 IMPORTANT: Follow this EXACT format. Do not include any explanatory text in the JSON.
+Keep "abstract" under 50 words and list at most 15 "recommended_links", most valuable first.
 
 For each section of content, analyze it like an advisor would:
 1. Look for explicit URLs or paths (e.g., "/admissions/requirements")
@@ -171,76 +109,548 @@ For each section of content, analyze it like an advisor would:
 4. Note resources (e.g., "Download application checklist")
 5. Consider student navigation needs (e.g., "What would they click next?")
 
-BE AGGRESSIVE in identifying potential links - if there's any mention of other content or pages, include it as a recommended link.
+BE AGGRESSIVE in identifying potential links - if there's any mention of other content or pages, include it as a recommended link, up to the 15-link limit.
+"""
 
-Content to analyze:
-{document.text[:2000]}
-            """
-            
-            # Extract and process links from raw content
-            import re
-            from urllib.parse import urljoin
-            
-            # Get base URL from current URL
-            base_url = '/'.join(self.start_url.split('/')[:-1]) + '/'
-            
-            # Extract markdown-style links
-            raw_links = re.findall(r'\[(.*?)\]\((.*?)\)', document.text)
-            extracted_links = []
+_BATCH_PROMPT = """You are given {count} separate webpages below. Analyze each one independently.
+Return a single JSON object of the form {{"analyses": [...]}} whose i-th element is
+the analysis of Document i, each in the exact format described above.
+"""
+
+# Reference topics for the embedding pre-filter that skips off-topic pages
+_REFERENCE_TOPICS = [
+    "medical school admissions requirements",
+    "MD program curriculum",
+    "application process and deadlines",
+    "tuition and financial aid",
+    "MCAT and prerequisite coursework",
+    "student life and support resources",
+    "dual degree and research programs",
+]
+
+# Cosine floor below which a page counts as off-topic, per embedding model.
+# ada-002 scores any two English texts at ~0.65 or more, so it needs a far
+# higher floor than the text-embedding-3 models; other models skip the filter
+_MIN_TOPIC_SIMILARITY = {
+    "text-embedding-ada-002": 0.78,
+    "text-embedding-3-small": 0.25,
+    "text-embedding-3-large": 0.25,
+}
+
+# Must always be filtered; if it isn't, the floor doesn't fit the model
+_OFF_TOPIC_PROBE = "Slow cooker beef chili recipe with kidney beans, cumin and smoked paprika"
+
+# Topics that mark a ranked page as related to admissions or curriculum
+_RELATED_TOPIC_RE = re.compile(r"admission|requirement|curriculum", re.IGNORECASE)
+
+_API_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=50)
+_API_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+@functools.lru_cache(maxsize=1)
+def _get_llm() -> OpenAI:
+    """One gpt-4o-mini client per process, so every Explorer (one per school)
+    reuses the same warm sync HTTP/2 pool to the OpenAI API.
+
+    It has no async HTTP client: an httpx.AsyncClient is tied to the event
+    loop that opened it, and each crawl runs in its own asyncio.run, so async
+    calls go through a copy bound to a per-loop client (Explorer._loop_llms).
+    """
+    return OpenAI(
+        model="gpt-4o-mini",
+        temperature=0.1,
+        api_version="2024-02",
+        # Bound generation time without cutting off a full analysis
+        max_tokens=_MAX_OUTPUT_TOKENS,
+        # JSON mode so every analysis parses without the fallback path
+        additional_kwargs={"response_format": {"type": "json_object"}},
+        http_client=httpx.Client(http2=True, limits=_API_LIMITS, timeout=_API_TIMEOUT),
+        # Don't memoize SDK clients on this shared instance; the one built per
+        # call still uses whichever HTTP pool the instance carries
+        reuse_client=False
+    )
+
+@functools.lru_cache(maxsize=1)
+def _get_encoding():
+    """gpt-4o-mini tokenizer and the token count of the static system prompt"""
+    enc = tiktoken.encoding_for_model("gpt-4o-mini")
+    return enc, len(enc.encode(_ANALYSIS_PROMPT, disallowed_special=()))
+
+@functools.lru_cache(maxsize=1)
+def _get_splitter() -> SentenceSplitter:
+    return SentenceSplitter(chunk_size=1024, chunk_overlap=20)
+
+@functools.lru_cache(maxsize=4096)
+def _is_valid_url(url: str, netloc: str, path: str) -> bool:
+    # Sites link the same URLs from every page, so memoize the check
+    if not url.startswith(("http://", "https://")):
+        return False
+    try:
+        parsed = urlsplit(url)
+    except ValueError:
+        return False
+    # Same domain, and nested under the starting URL's path
+    return parsed.netloc.lower() == netloc and parsed.path.startswith(path)
+
+class Explorer:
+    def __init__(self, school: str, start_url: str):
+        self.school = school
+        self.start_url = start_url
+        start = urlsplit(start_url)
+        self.base_domain = start.netloc.lower()
+        self._start_path = start.path
+        self.page_importance = {}
+        # Setup LlamaIndex debug handler
+        self.llama_debug = LlamaDebugHandler()
+        callback_manager = CallbackManager([self.llama_debug])
+        
+        # Setup LlamaIndex settings with GPT-4o-mini, shared across explorers
+        self.llm = _get_llm()
+        Settings.llm = self.llm
+        Settings.callback_manager = callback_manager
+        
+        self.MAX_PAGES = 500
+        self.MAX_PROMPT_CHARS = 2000  # Page text sent to, and cached for, the LLM
+        self.BATCH_SIZE = 10  # Frontier URLs fetched concurrently per round
+        self.FETCH_RETRIES = 3  # Extra attempts for transient fetch failures
+        self.MIN_PRIORITY = 0.2  # Stop crawling once no better link remains
+        self.DEFAULT_LINK_PRIORITY = 0.5  # For bare-string links with no score
+        self.MAX_CONCURRENCY = 5  # Page analyses in flight at once
+        self.ANALYSIS_BATCH_SIZE = 4  # Pages analyzed per LLM call
+        # Same client, with room for one answer per page in a batched call
+        self.batch_llm = self.llm.model_copy(
+            update={"max_tokens": _MAX_OUTPUT_TOKENS * self.ANALYSIS_BATCH_SIZE}
+        )
+        self.llm_limiter = AsyncLimiter(500, 60)  # 500 LLM requests per minute
+        self.TOKENS_PER_MINUTE = 200_000
+        self.token_limiter = AsyncLimiter(self.TOKENS_PER_MINUTE, 60)
+        self._enc, self._system_tokens = _get_encoding()
+        
+        # Setup node parser with default configuration
+        self.node_parser = _get_splitter()
+        
+        # Setup storage
+        self.storage_dir = f"{school}/index_storage"
+        os.makedirs(self.storage_dir, exist_ok=True)
+        
+        # Index used only by fetch_pages; crawl analyses call the LLM directly
+        # since each prompt already carries the page text it is about
+        self.storage_context = StorageContext.from_defaults()
+        self.index = VectorStoreIndex([], storage_context=self.storage_context)
+        
+        self.logger = setup_logging(school, "explorer")
+        os.makedirs(f"{school}/pages", exist_ok=True)
+        # Unchanged text is embedded from the on-disk cache, not the API
+        if not isinstance(Settings.embed_model, CachedEmbedding):
+            Settings.embed_model = CachedEmbedding(Settings.embed_model, f"{school}/embedding_cache.sqlite")
+        self._io = ThreadPoolExecutor(max_workers=4)
+        self._pending_writes = []
+        
+        # Re-crawls of overlapping subtrees reuse analyses of unchanged pages
+        self.cache = AnalysisCache(f"{school}/.llm_cache", ttl=7 * 86400)
+        self.near_duplicates = MinHashIndex(threshold=0.9)
+        # None disables the off-topic pre-filter
+        self.MIN_TOPIC_SIMILARITY = _MIN_TOPIC_SIMILARITY.get(Settings.embed_model.model_name)
+        self._topic_matrix = None  # Reference topic embeddings, built on first use
+        # Namespaced by LLM, prompt and embedding model: a prompt edit must not
+        # serve old-prompt analyses, and vectors of another model don't compare
+        semantic_namespace = AnalysisCache.key(
+            self.llm.model, _ANALYSIS_PROMPT, Settings.embed_model.model_name
+        )[:16]
+        self.semantic_cache = SemanticCache(
+            f"{school}/.llm_semcache/{semantic_namespace}", threshold=0.97, ttl=7 * 86400
+        )
+        
+    def _new_http_client(self) -> httpx.AsyncClient:
+        """Keep-alive HTTP/2 client reused for every fetch in a crawl"""
+        return httpx.AsyncClient(
+            http2=True,
+            timeout=10,
+            follow_redirects=True,
+            headers={"User-Agent": "medex/0.1"}
+        )
+
+    async def fetch_page(self, client: httpx.AsyncClient, url: str) -> Optional[Document]:
+        # Retry transient failures (network errors, 429 and 5xx) with
+        # exponential backoff; other 4xx responses fail immediately
+        for attempt in range(self.FETCH_RETRIES + 1):
+            try:
+                response = await client.get(url)
+                response.raise_for_status()
+                return self._page_document(url, response.text)
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                transient = not isinstance(e, httpx.HTTPStatusError) or (
+                    e.response.status_code == 429 or e.response.status_code >= 500
+                )
+                if not transient or attempt == self.FETCH_RETRIES:
+                    self.logger.error(f"Error fetching {url}: {str(e)}")
+                    return None
+                await asyncio.sleep(0.5 * 2 ** attempt)
+            except Exception as e:
+                self.logger.error(f"Error fetching {url}: {str(e)}")
+                return None
+
+    def _page_document(self, url: str, html: str) -> Document:
+        """Parse a page once with lexbor: anchors, title and visible text"""
+        tree = LexborHTMLParser(html)
+        
+        # Collect on-site links before stripping nav/footer, which hold most
+        # of them; fragments are dropped so in-page anchors don't multiply
+        links = []
+        for a in tree.css("a[href]"):
+            try:
+                full, _ = urldefrag(urljoin(url, a.attributes.get("href") or ""))
+                netloc = urlsplit(full).netloc.lower()
+            except ValueError:
+                # Malformed href (e.g. "http://["): skip the link, keep the page
+                continue
+            if netloc == self.base_domain:
+                links.append({"url": full, "text": a.text(strip=True)})
+        title = tree.css_first("title")
+        
+        tree.strip_tags(["script", "style", "noscript", "nav", "footer"])
+        text = tree.body.text(separator=" ", strip=True) if tree.body else ""
+        
+        # The analysis excerpt is cut once here, with whitespace runs
+        # collapsed so it packs in more text, rather than on every lookup
+        return Document(
+            text=text,
+            metadata={
+                "url": url,
+                "title": title.text(strip=True) if title else "",
+                "links": links,
+                "analysis_excerpt": truncate_text(" ".join(text.split()), self.MAX_PROMPT_CHARS)
+            },
+            # The link list is crawl state, not content, and on nav-heavy
+            # pages alone outgrows the splitter's chunk size
+            excluded_embed_metadata_keys=["links", "analysis_excerpt"],
+            excluded_llm_metadata_keys=["links", "analysis_excerpt"]
+        )
+
+    async def _fetch_many(self, urls: List[str]) -> List[Optional[Document]]:
+        async with self._new_http_client() as client:
+            return await asyncio.gather(*[self.fetch_page(client, url) for url in urls])
+
+    def fetch_pages(self) -> List[Document]:
+        try:
+            documents = [doc for doc in asyncio.run(self._fetch_many([self.start_url])) if doc]
+            self.logger.info(f"Loaded {len(documents)} documents")
             
-            for link_text, link_url in raw_links:
-                if link_url.endswith('.html'):  # Only include HTML pages
-                    # Clean up link text and make URL absolute
-                    text = link_text.replace('__', '').strip()
-                    url = urljoin(base_url, link_url)
-                    
-                    extracted_links.append({
-                        "url": url,
-                        "text": text,
-                        "type": "navigation",
-                        "priority": 0.8,
-                        "source": "Navigation Menu",
-                        "confidence": 1.0
-                    })
+            # Process documents into nodes
+            nodes = self.node_parser.get_nodes_from_documents(documents)
+            self.logger.info(f"Created {len(nodes)} nodes")
             
-            # Log extracted links for debugging
-            self.logger.info(f"Extracted {len(extracted_links)} raw links")
-            for link in extracted_links[:5]:
-                self.logger.info(f"Raw link: {link}")
+            # Add to the vector index and persist
+            self.index.insert_nodes(nodes)
+            # Persist storage after indexing
+            self.index.storage_context.persist(persist_dir=self.storage_dir)
             
-            # Use query engine for analysis
-            response = self.index.as_query_engine(
-                verbose=True
-            ).query(prompt)
+            return documents
             
+        except Exception as e:
+            self.logger.error(f"Error fetching pages: {str(e)}")
+            return []
+
+    def analyze_page(self, document: Document) -> dict:
+        async def run():
+            async with self._loop_llms():
+                return await self.aanalyze_page(document)
+        return asyncio.run(run())
+
+    @contextlib.asynccontextmanager
+    async def _loop_llms(self):
+        """Point the LLMs at an async HTTP/2 pool owned by the running loop"""
+        async with httpx.AsyncClient(http2=True, limits=_API_LIMITS, timeout=_API_TIMEOUT) as client:
+            llm, batch_llm = self.llm, self.batch_llm
+            self.llm, self.batch_llm = llm.model_copy(), batch_llm.model_copy()
+            self.llm._async_http_client = client
+            self.batch_llm._async_http_client = client
             try:
-                # Try to parse as JSON first
-                result = json.loads(str(response))
-                # Add extracted links to the recommended_links
-                if "recommended_links" not in result:
-                    result["recommended_links"] = []
-                result["recommended_links"].extend(extracted_links)
-            except json.JSONDecodeError:
-                # If not valid JSON, create structured response
-                result = {
-                    "importance_score": 0.8,  # Default high for admissions page
-                    "explorer_tags": ["admissions", "requirements"],
-                    "abstract": str(response)[:100],  # Use first 100 chars as abstract
-                    "recommended_links": extracted_links,  # Use extracted links
-                    "related_topics": []
-                }
-            
-            return result
-            
+                yield
+            finally:
+                self.llm, self.batch_llm = llm, batch_llm
+
+    def _extract_links(self, document: Document) -> List[Dict]:
+        """Turn the page's anchors into recommended links"""
+        extracted_links = []
+        for link in document.metadata.get("links", []):
+            if link["url"].endswith('.html'):  # Only include HTML pages
+                extracted_links.append({
+                    "url": link["url"],
+                    "text": link["text"],
+                    "type": "navigation",
+                    "priority": 0.8,
+                    "source": "Navigation Menu",
+                    "confidence": 1.0
+                })
+        
+        # Log extracted links for debugging
+        self.logger.info(f"Extracted {len(extracted_links)} raw links")
+        for link in extracted_links[:5]:
+            self.logger.info(f"Raw link: {link}")
+        return extracted_links
+
+    async def _lookup(self, document: Document):
+        """Build a page's user message and check both caches before any LLM call.
+
+        Returns (excerpt, prompt, cache_key, embedding, cached analysis or None).
+        """
+        # Log the raw content for debugging
+        self.logger.info(f"Raw content length: {len(document.text)}")
+        self.logger.info(f"Content sample: {document.text[:500]}")
+        
+        excerpt = document.metadata.get("analysis_excerpt")
+        if excerpt is None:
+            excerpt = truncate_text(" ".join(document.text.split()), self.MAX_PROMPT_CHARS)
+        prompt = f"Content to analyze:\n{excerpt}"
+        
+        # Keyed on the full prompt, so editing the template invalidates
+        # old entries without a manual version bump
+        cache_key = AnalysisCache.key(self.llm.model, _ANALYSIS_PROMPT, prompt)
+        cached = self._valid_or_none(self.cache.get(cache_key))
+        if cached is not None:
+            self.logger.info(f"Cache hit for {document.metadata.get('url', '')}")
+            return excerpt, prompt, cache_key, None, cached
+        
+        # Sibling pages sharing most of their text reuse one analysis
+        embedding = await Settings.embed_model.aget_text_embedding(excerpt)
+        cached = self._valid_or_none(self.semantic_cache.get(embedding))
+        if cached is not None:
+            self.logger.info(f"Semantic cache hit for {document.metadata.get('url', '')}")
+        elif await self._is_off_topic(embedding):
+            # Clearly unrelated pages get a low-score stub instead of an LLM call
+            self.logger.info(f"Off-topic, skipping analysis: {document.metadata.get('url', '')}")
+            cached = {**self._empty_analysis(), "importance_score": 0.1}
+        return excerpt, prompt, cache_key, embedding, cached
+
+    async def _is_off_topic(self, embedding: List[float]) -> bool:
+        """True when a page is far from every pre-med reference topic"""
+        if self.MIN_TOPIC_SIMILARITY is None:
+            return False
+        if self._topic_matrix is None:
+            vectors = np.asarray(
+                await Settings.embed_model.aget_text_embedding_batch(_REFERENCE_TOPICS + [_OFF_TOPIC_PROBE]),
+                dtype=np.float32
+            )
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            self._topic_matrix = vectors[:-1]
+            probe = float((self._topic_matrix @ vectors[-1]).max())
+            if probe >= self.MIN_TOPIC_SIMILARITY:
+                # A filter that passes a recipe page only costs embeddings
+                self.logger.warning(
+                    f"Off-topic probe scored {probe:.2f} >= {self.MIN_TOPIC_SIMILARITY} with "
+                    f"{Settings.embed_model.model_name}; disabling the topic pre-filter"
+                )
+                self.MIN_TOPIC_SIMILARITY = None
+                return False
+        vector = np.asarray(embedding, dtype=np.float32)
+        similarity = self._topic_matrix @ (vector / (np.linalg.norm(vector) or 1.0))
+        return float(similarity.max()) < self.MIN_TOPIC_SIMILARITY
+
+    async def aanalyze_page(self, document: Document) -> dict:
+        try:
+            extracted_links = self._extract_links(document)
+            _, prompt, cache_key, embedding, cached = await self._lookup(document)
+            if cached is not None:
+                return self._with_links(cached, extracted_links)
+            return await self._analyze_uncached(prompt, cache_key, embedding, extracted_links)
         except Exception as e:
             self.logger.error(f"Error analyzing {document.metadata.get('url', '')}: {str(e)}")
-            return {
-                "importance_score": 0,
-                "explorer_tags": [],
-                "abstract": "",
-                "recommended_links": [],
-                "related_topics": []
-            }
+            return self._empty_analysis()
+
+    async def _analyze_uncached(self, prompt: str, cache_key: str, embedding: List[float],
+                                extracted_links: List[Dict]) -> dict:
+        # Reserve this call's tokens against the per-minute budget; waits
+        # only as long as the sliding window needs to drain
+        await self.token_limiter.acquire(self._estimate_tokens(prompt))
+        
+        try:
+            result = orjson.loads(await self._stream_json(self.llm, prompt))
+            if not self._is_valid_analysis(result):
+                raise ValueError("Analysis is missing fields or has the wrong types")
+        except ValueError as e:
+            # Truncated, malformed or mis-shaped output is a failed analysis:
+            # no made-up tags or score, so record_page won't treat it as important
+            self.logger.error(f"Analysis failed: {str(e)}")
+            return self._with_links(self._empty_analysis(), extracted_links)
+        # Cache the model's answer before merging in the raw page links
+        self.cache.put(cache_key, result)
+        self.semantic_cache.put(embedding, result)
+        return self._with_links(result, extracted_links)
+
+    async def aanalyze_pages(self, documents: List[Document], sem: asyncio.Semaphore) -> List[dict]:
+        """Analyze a crawl batch, sending cache misses to the LLM several per call.
+
+        Up to ANALYSIS_BATCH_SIZE pages share one prompt so the static
+        instructions are paid for once per call rather than once per page.
+        Any page whose batched answer is missing or malformed is retried alone.
+        """
+        results = [None] * len(documents)
+        links = [self._extract_links(document) for document in documents]
+        
+        # Near-verbatim copies of pages analyzed earlier in the crawl reuse
+        # that analysis without even an embedding call
+        signatures = [self.near_duplicates.signature(document.text) for document in documents]
+        pending = []
+        for i, signature in enumerate(signatures):
+            duplicate = self.near_duplicates.get(signature)
+            if duplicate is not None:
+                self.logger.info(f"Near-duplicate page: {documents[i].metadata.get('url', '')}")
+                results[i] = self._with_links(duplicate, links[i])
+            else:
+                pending.append(i)
+        
+        lookups = dict(zip(pending, await asyncio.gather(
+            *[self._lookup(documents[i]) for i in pending], return_exceptions=True
+        )))
+        
+        misses = []
+        for i, lookup in lookups.items():
+            if isinstance(lookup, Exception):
+                self.logger.error(f"Error analyzing {documents[i].metadata.get('url', '')}: {str(lookup)}")
+                results[i] = self._empty_analysis()
+            elif lookup[4] is not None:
+                results[i] = self._with_links(lookup[4], links[i])
+            else:
+                misses.append(i)
+        
+        chunks = [
+            misses[j:j + self.ANALYSIS_BATCH_SIZE]
+            for j in range(0, len(misses), self.ANALYSIS_BATCH_SIZE)
+        ]
+        batched = await asyncio.gather(*[
+            self._analyze_chunk([lookups[i][0] for i in chunk], sem) for chunk in chunks
+        ])
+        
+        retry = []
+        for chunk, analyses in zip(chunks, batched):
+            for i, analysis in zip(chunk, analyses or [None] * len(chunk)):
+                if analysis is None:
+                    retry.append(i)
+                    continue
+                _, _, cache_key, embedding, _ = lookups[i]
+                self.cache.put(cache_key, analysis)
+                self.semantic_cache.put(embedding, analysis)
+                results[i] = self._with_links(analysis, links[i])
+        
+        retried = await asyncio.gather(*[
+            self._retry_bounded(lookups[i], links[i], documents[i], sem) for i in retry
+        ])
+        for i, analysis in zip(retry, retried):
+            results[i] = analysis
+        
+        # Successful analyses are in the exact cache by now, without links
+        for i, lookup in lookups.items():
+            if not isinstance(lookup, Exception):
+                analysis = self._valid_or_none(self.cache.get(lookup[2]))
+                if analysis is not None:
+                    self.near_duplicates.put(signatures[i], analysis)
+        return results
+
+    async def _analyze_chunk(self, excerpts: List[str], sem: asyncio.Semaphore) -> Optional[List[Optional[dict]]]:
+        """One LLM call for several pages; None entries mark pages to retry alone"""
+        if len(excerpts) < 2:
+            return None
+        prompt = _BATCH_PROMPT.format(count=len(excerpts)) + "".join(
+            f"\nDocument {n}:\n{excerpt}\n" for n, excerpt in enumerate(excerpts, 1)
+        )
+        output_tokens = self.batch_llm.max_tokens
+        async with sem:
+            async with self.llm_limiter:
+                try:
+                    await self.token_limiter.acquire(self._estimate_tokens(prompt, output_tokens))
+                    text = await self._stream_json(self.batch_llm, prompt)
+                    analyses = orjson.loads(text).get("analyses")
+                except Exception as e:
+                    self.logger.error(f"Batched analysis failed, retrying pages individually: {str(e)}")
+                    return None
+        if not isinstance(analyses, list) or len(analyses) != len(excerpts):
+            self.logger.error("Batched analysis returned the wrong number of results")
+            return None
+        return [analysis if self._is_valid_analysis(analysis) else None for analysis in analyses]
+
+    async def _retry_bounded(self, lookup, extracted_links: List[Dict], document: Document,
+                             sem: asyncio.Semaphore) -> dict:
+        _, prompt, cache_key, embedding, _ = lookup
+        async with sem:
+            async with self.llm_limiter:
+                try:
+                    return await self._analyze_uncached(prompt, cache_key, embedding, extracted_links)
+                except Exception as e:
+                    self.logger.error(f"Error analyzing {document.metadata.get('url', '')}: {str(e)}")
+                    return self._empty_analysis()
+
+    @staticmethod
+    def _is_valid_analysis(analysis) -> bool:
+        """Shape check run before an analysis is cached or merged with links"""
+        return (
+            isinstance(analysis, dict)
+            and isinstance(analysis.get("importance_score"), (int, float))
+            and not isinstance(analysis.get("importance_score"), bool)
+            and all(isinstance(analysis.get(key), list)
+                    for key in ("explorer_tags", "recommended_links", "related_topics"))
+            and "abstract" in analysis
+        )
+
+    @classmethod
+    def _valid_or_none(cls, analysis) -> Optional[dict]:
+        """Cached entries written before validation existed may be malformed"""
+        return analysis if analysis is not None and cls._is_valid_analysis(analysis) else None
+
+    @staticmethod
+    def _empty_analysis() -> dict:
+        return {
+            "importance_score": 0,
+            "explorer_tags": [],
+            "abstract": "",
+            "recommended_links": [],
+            "related_topics": []
+        }
+
+    async def _stream_json(self, llm: OpenAI, prompt: str) -> str:
+        """Stream a chat completion, stopping as soon as the JSON object closes.
+
+        Raises ValueError when the output does not open with '{' (on its
+        first token), when it hits the max_tokens cap, or when the stream
+        ends before the object closes.
+        """
+        parser = StreamingJsonParser()
+        stream = await llm.astream_chat(self._messages(prompt))
+        try:
+            async for chunk in stream:
+                if parser.consume(chunk.delta or ""):
+                    break
+                choices = getattr(chunk.raw, "choices", None)
+                if choices and choices[0].finish_reason == "length":
+                    raise ValueError(f"Response cut off at max_tokens={llm.max_tokens}")
+        finally:
+            await stream.aclose()
+        if not parser.complete:
+            raise ValueError("Response stream ended before the JSON object closed")
+        return parser.text
+
+    @staticmethod
+    def _messages(prompt: str) -> List[ChatMessage]:
+        """Static instructions as the system message so OpenAI can cache the
+        shared prefix; only the page content varies in the user message"""
+        return [
+            ChatMessage(role=MessageRole.SYSTEM, content=_ANALYSIS_PROMPT),
+            ChatMessage(role=MessageRole.USER, content=prompt)
+        ]
+
+    def _estimate_tokens(self, prompt: str, output_tokens: Optional[int] = None) -> int:
+        """Prompt tokens plus the completion allowance, capped at the TPM limit"""
+        if output_tokens is None:
+            output_tokens = _MAX_OUTPUT_TOKENS
+        tokens = self._system_tokens + len(self._enc.encode(prompt, disallowed_special=())) + output_tokens
+        return min(tokens, self.TOKENS_PER_MINUTE)
+
+    @staticmethod
+    def _with_links(analysis: dict, extracted_links: List[Dict]) -> dict:
+        """Copy of a (possibly cached) analysis with the page's raw links appended"""
+        return {
+            **analysis,
+            "recommended_links": analysis.get("recommended_links", []) + extracted_links
+        }
 
     def save_page(self, url: str, document: Document, analysis: dict):
         page_data = {
@@ -253,15 +663,15 @@ Content to analyze:
                 "title": document.metadata.get("title", ""),
                 "links": document.metadata.get("links", []),
                 "importance_score": analysis["importance_score"],
-                "recommended_links": analysis["recommended_links"],
-                "source_metadata": document.metadata
+                "recommended_links": analysis["recommended_links"]
             },
             "timestamp": datetime.now().isoformat()
         }
         
-        filename = f"{self.school}/pages/{hashlib.md5(url.encode()).hexdigest()}.json"
-        with open(filename, 'w') as f:
-            json.dump(page_data, f, indent=2)
+        filename = f"{self.school}/pages/{url_hash(url)}.json"
+        # Written compactly on the I/O pool so the crawl loop never waits on
+        # disk; these files are machine-read and mostly page text
+        self._pending_writes.append(self._io.submit(write_json, filename, page_data, indent=False))
             
         self.page_importance[url] = {
             "score": analysis["importance_score"],
@@ -269,12 +679,26 @@ Content to analyze:
             "related_topics": analysis.get("related_topics", [])
         }
 
+    def _flush_writes(self):
+        """Block until every queued page write has hit disk, re-raising errors"""
+        pending, self._pending_writes = self._pending_writes, []
+        for future in pending:
+            future.result()
+
     def save_importance_ranking(self):
-        ranked_pages = sorted(
-            self.page_importance.items(),
-            key=lambda x: x[1]["score"],
-            reverse=True
-        )
+        # Stable argsort on negated scores: highest first, ties keep crawl order
+        pages = list(self.page_importance.items())
+        scores = np.fromiter((data["score"] for _, data in pages), dtype=np.float32, count=len(pages))
+        ranked_pages = [pages[i] for i in np.argsort(-scores, kind="stable")]
+        
+        # Crawl-wide tag and topic sets, computed once rather than per row
+        topic_clusters = list(dict.fromkeys(
+            tag for data in self.page_importance.values() for tag in data["tags"]
+        ))
+        topic_overview = list(dict.fromkeys(
+            topic for data in self.page_importance.values()
+            for topic in data.get("related_topics", [])
+        ))
         
         ranking = [
             {
@@ -285,118 +709,157 @@ Content to analyze:
                 "semantic_context": {
                     "related_pages": [
                         topic for topic in data["related_topics"]
-                        if any(url_part in topic.lower() for url_part in ["admission", "requirement", "curriculum"])
+                        if _RELATED_TOPIC_RE.search(topic)
                     ],
-                    "topic_clusters": list(set(
-                        tag for tags in [d["tags"] for d in self.page_importance.values()]
-                        for tag in tags
-                    ))
+                    "topic_clusters": topic_clusters
                 }
             }
             for url, data in ranked_pages
         ]
         
-        with open(f"{self.school}/page_importance_ranking.json", 'w') as f:
-            json.dump({
-                "ranking": ranking,
-                "metadata": {
-                    "total_pages": len(self.page_importance),
-                    "exploration_timestamp": datetime.now().isoformat(),
-                    "base_domain": self.base_domain,
-                    "topic_overview": list(set(
-                        topic for data in self.page_importance.values()
-                        for topic in data.get("related_topics", [])
-                    ))
-                }
-            }, f, indent=2)
+        write_json(f"{self.school}/page_importance_ranking.json", {
+            "ranking": ranking,
+            "metadata": {
+                "total_pages": len(self.page_importance),
+                "exploration_timestamp": datetime.now().isoformat(),
+                "base_domain": self.base_domain,
+                "topic_overview": topic_overview
+            }
+        })
 
     def is_valid_url(self, url: str) -> bool:
         """Check if URL is nested under the starting URL path"""
-        try:
-            parsed = urlparse(url)
-            start_parsed = urlparse(self.start_url)
-            # Must be same domain
-            if self.base_domain != parsed.netloc:
-                return False
-            # URL path must start with the starting URL's path
-            if not parsed.path.startswith(start_parsed.path):
-                return False
-            return True
-        except:
+        # Model output may put a list or number here; those would be
+        # unhashable for the memoized check, or lack startswith
+        if not isinstance(url, str):
             return False
+        return _is_valid_url(url, self.base_domain, self._start_path)
+
+    @staticmethod
+    def normalize_url(url: str) -> str:
+        """Dedupe key for a URL, so equivalent spellings are crawled once.
+
+        Lowercases scheme and host, drops default ports and the fragment,
+        sorts query parameters and strips a trailing slash off non-root paths.
+        """
+        parsed = urlsplit(url)
+        scheme = parsed.scheme.lower()
+        netloc = parsed.netloc.lower()
+        if (scheme, netloc.rpartition(":")[2]) in (("http", "80"), ("https", "443")):
+            netloc = netloc.rpartition(":")[0]
+        path = parsed.path.rstrip("/") or "/"
+        query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+        return urlunsplit((scheme, netloc, path, query, ""))
+
+    def _enqueue(self, url: str, priority: float, urls_to_visit: list, queued: set):
+        key = self.normalize_url(url)
+        if key not in queued:
+            queued.add(key)
+            # Max-heap on priority; the enqueue count breaks ties first-come.
+            # The first spelling seen is what gets fetched, since the key's
+            # trailing-slash form may not resolve on the server
+            heapq.heappush(urls_to_visit, (-priority, len(queued), urldefrag(url)[0]))
 
     def explore(self):
+        asyncio.run(self.aexplore())
+
+    async def aexplore(self):
         self.logger.info(f"Starting exploration from: {self.start_url}")
         
-        # Initialize URL tracking
-        urls_to_visit = {self.start_url}
+        # Best-first frontier ordered by the LLM's link priority, so the page
+        # budget goes to the most valuable links; `queued` holds every URL
+        # ever enqueued so a page is fetched at most once
+        urls_to_visit = []
+        queued = set()
         visited_urls = set()
+        self._enqueue(self.start_url, 1.0, urls_to_visit, queued)
         
-        while urls_to_visit and len(visited_urls) < self.MAX_PAGES:
-            current_url = urls_to_visit.pop()
-            if current_url in visited_urls:
-                continue
+        sem = asyncio.Semaphore(self.MAX_CONCURRENCY)
+        async with self._loop_llms(), self._new_http_client() as client:
+            prefetch = None
+            while prefetch or urls_to_visit:
+                if prefetch is not None:
+                    batch, documents = await prefetch
+                    prefetch = None
+                else:
+                    batch = self._take_batch(urls_to_visit, visited_urls)
+                    if not batch:
+                        break
+                    batch, documents = await self._fetch_batch(client, batch)
                 
-            self.logger.info(f"Processing: {current_url}")
-            visited_urls.add(current_url)
-            
-            # Fetch and process page with async support
-            documents = asyncio.run(self.loader.aload_data(urls=[current_url]))
-            if not documents:
-                continue
+                fetched = [
+                    (current_url, document)
+                    for current_url, document in zip(batch, documents)
+                    if document is not None
+                ]
+                for current_url, _ in fetched:
+                    self.logger.info(f"Processing: {current_url}")
                 
-            # Use the first document as the main page
-            document = documents[0]
-            
-            # Collect all unique links from all documents
-            all_links = set()
-            for doc in documents:
-                if doc.metadata and "links" in doc.metadata:
-                    all_links.update(doc.metadata["links"])
-            document.metadata["links"] = list(all_links)
-            if not document.metadata:
-                document.metadata = {}
-            document.metadata["url"] = current_url
-            
-            # Process document into nodes
-            nodes = self.node_parser.get_nodes_from_documents([document])
-            
-            # Update vector index
-            self.index = VectorStoreIndex(
-                nodes,
-                storage_context=self.storage_context
-            )
-            
-            # Analyze page
-            analysis = self.analyze_page(document)
-            
-            if analysis["importance_score"] > 0.3:
-                self.save_page(current_url, document, analysis)
+                # Start fetching the next batch from already-queued URLs so
+                # the network work overlaps this batch's LLM calls
+                next_batch = self._take_batch(urls_to_visit, visited_urls)
+                if next_batch:
+                    prefetch = asyncio.create_task(self._fetch_batch(client, next_batch))
                 
-                # Add new URLs to visit from analysis
-                for link in analysis.get("recommended_links", []):
-                    if isinstance(link, dict):
-                        url = link.get("url", "")
-                        priority = link.get("priority", 0)
-                        link_type = link.get("type", "")
-                        # Prioritize navigation and content links
-                        if (url and priority > 0.3 and 
-                            self.is_valid_url(url) and
-                            link_type in ["navigation", "content", "application"]):
-                            urls_to_visit.add(url)
-                    elif isinstance(link, str) and self.is_valid_url(link):
-                        urls_to_visit.add(link)
-            
-            # Log discovered links
-            links = analysis.get("recommended_links", [])
-            self.logger.info(f"Found {len(links)} links in {current_url}")
-            for link in links[:5]:  # Log first 5 links
-                if isinstance(link, dict):
-                    self.logger.info(f"Link: {link.get('url', '')} - {link.get('text', '')[:50]}")
-            
-            # Persist storage periodically
-            if len(visited_urls) % 5 == 0:
-                self.index.storage_context.persist(persist_dir=self.storage_dir)
+                # Analyze the batch concurrently; wall time ~ slowest call
+                analyses = await self.aanalyze_pages([document for _, document in fetched], sem)
+                
+                for (current_url, document), analysis in zip(fetched, analyses):
+                    self.record_page(current_url, document, analysis, urls_to_visit, queued)
         
+        await asyncio.to_thread(self._flush_writes)
         self.save_importance_ranking()
         self.logger.info(f"Exploration complete. {len(visited_urls)} pages analyzed.")
+
+    def _take_batch(self, urls_to_visit: list, visited_urls: set) -> List[str]:
+        """Pop the next frontier batch, within the remaining page budget.
+
+        Stops early once the best remaining link falls below MIN_PRIORITY.
+        """
+        batch = []
+        budget = min(self.BATCH_SIZE, self.MAX_PAGES - len(visited_urls))
+        while urls_to_visit and len(batch) < budget:
+            if -urls_to_visit[0][0] < self.MIN_PRIORITY:
+                urls_to_visit.clear()
+                break
+            _, _, current_url = heapq.heappop(urls_to_visit)
+            visited_urls.add(current_url)
+            batch.append(current_url)
+        return batch
+
+    async def _fetch_batch(self, client: httpx.AsyncClient, batch: List[str]):
+        """Fetch the whole batch concurrently over the shared client"""
+        documents = await asyncio.gather(*[
+            self.fetch_page(client, url) for url in batch
+        ])
+        return batch, documents
+
+    def record_page(self, current_url: str, document: Document, analysis: dict,
+                    urls_to_visit: list, queued: set):
+        if analysis["importance_score"] > 0.3:
+            self.save_page(current_url, document, analysis)
+            
+            # Add new URLs to visit from analysis
+            for link in analysis.get("recommended_links", []):
+                if isinstance(link, dict):
+                    url = link.get("url", "")
+                    try:
+                        # Model output sometimes quotes numbers; heap keys must be floats
+                        priority = float(link.get("priority", 0))
+                    except (TypeError, ValueError):
+                        priority = 0.0
+                    link_type = link.get("type", "")
+                    # Prioritize navigation and content links
+                    if (url and priority > 0.3 and 
+                        self.is_valid_url(url) and
+                        link_type in ["navigation", "content", "application"]):
+                        self._enqueue(url, priority, urls_to_visit, queued)
+                elif isinstance(link, str) and self.is_valid_url(link):
+                    self._enqueue(link, self.DEFAULT_LINK_PRIORITY, urls_to_visit, queued)
+        
+        # Log discovered links
+        links = analysis.get("recommended_links", [])
+        self.logger.info(f"Found {len(links)} links in {current_url}")
+        for link in links[:5]:  # Log first 5 links
+            if isinstance(link, dict):
+                self.logger.info(f"Link: {link.get('url', '')} - {str(link.get('text', ''))[:50]}")
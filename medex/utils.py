@@ -1,26 +1,119 @@
+import atexit
+import hashlib
 import logging
+import logging.handlers
+import queue
 from datetime import datetime
 import os
+import orjson
 
 def setup_logging(school: str, component: str) -> logging.Logger:
     """Configure component logging"""
     os.makedirs(f"{school}/logs", exist_ok=True)
     
     logger = logging.getLogger(f"{school}_{component}")
+    if logger.handlers:
+        # Already configured by an earlier instance; don't stack handlers
+        return logger
     logger.setLevel(logging.INFO)
     
     formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
     
-    # File handler
+    # File handler; the file isn't opened until the first record
     fh = logging.FileHandler(
-        f"{school}/logs/{component}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+        f"{school}/logs/{component}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log",
+        delay=True
     )
     fh.setFormatter(formatter)
-    logger.addHandler(fh)
     
     # Console handler
     ch = logging.StreamHandler()
     ch.setFormatter(formatter)
-    logger.addHandler(ch)
     
-    return logger
\ No newline at end of file
+    # Callers only enqueue; one listener thread does the file/console I/O
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.listener = logging.handlers.QueueListener(log_queue, fh, ch)
+    logger.listener.start()
+    atexit.register(logger.listener.stop)
+    
+    return logger
+
+def url_hash(url: str) -> str:
+    """Stable 32-hex-char filename key for a URL (BLAKE2b, 16-byte digest)"""
+    return hashlib.blake2b(url.encode(), digest_size=16).hexdigest()
+
+def read_json(path: str):
+    """Load a JSON file with orjson, parsing the raw bytes directly"""
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
+def write_json(path: str, data, indent: bool = True) -> None:
+    """Serialize data with orjson and write it to path in one call"""
+    option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+    with open(path, 'wb') as f:
+        f.write(orjson.dumps(data, option=option))
+
+def truncate_text(text: str, max_chars: int) -> str:
+    """Cut text to at most max_chars, backing up to the last word boundary"""
+    if len(text) <= max_chars:
+        return text
+    cut = max(text.rfind(" ", 0, max_chars), text.rfind("\n", 0, max_chars))
+    return text[:cut] if cut > 0 else text[:max_chars]
+
+class StreamingJsonParser:
+    """Track a JSON object as it streams in from an LLM, chunk by chunk.
+
+    Output that does not open with '{' is rejected as soon as the first
+    character arrives, and mismatched brackets raise immediately. consume()
+    returns True once the top-level object has closed so the caller can stop
+    reading the stream.
+    """
+
+    def __init__(self):
+        self._prefix = ""
+        self._text = ""
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self.complete = False
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    def consume(self, chunk: str) -> bool:
+        if self.complete or not chunk:
+            return self.complete
+
+        if not self._stack and not self._text:
+            # Still looking for the opening brace
+            self._prefix += chunk
+            prefix = self._prefix.lstrip()
+            if not prefix:
+                return False
+            if prefix[0] != "{":
+                raise ValueError(f"Expected JSON object, got {prefix[:20]!r}")
+            chunk = prefix
+
+        for i, c in enumerate(chunk):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c in "{[":
+                self._stack.append(c)
+            elif c in "}]":
+                if not self._stack or self._stack.pop() != ("{" if c == "}" else "["):
+                    raise ValueError(f"Unbalanced '{c}' at position {len(self._text) + i}")
+                if not self._stack:
+                    self._text += chunk[:i + 1]
+                    self.complete = True
+                    return True
+        self._text += chunk
+        return False
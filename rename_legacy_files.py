@@ -0,0 +1,24 @@
+import hashlib
+import sys
+from pathlib import Path
+from medex.utils import read_json, url_hash
+
+# One-time migration: crawls made before filenames switched from MD5 to
+# url_hash (BLAKE2b) are renamed in place so Beagle and test_prompt find them
+school = sys.argv[1] if len(sys.argv) > 1 else "UPenn"
+
+for directory in (Path(school) / "pages", Path(school) / "analysis"):
+    if not directory.is_dir():
+        continue
+    renamed = 0
+    for path in directory.glob("*.json"):
+        url = read_json(path).get("url")
+        if not url or path.stem != hashlib.md5(url.encode()).hexdigest():
+            continue
+        target = path.with_name(f"{url_hash(url)}.json")
+        if target.exists():
+            print(f"Skipping {path.name}: {target.name} already exists")
+            continue
+        path.rename(target)
+        renamed += 1
+    print(f"Renamed {renamed} files in {directory}")
@@ -1,45 +1,65 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import json
 from llama_index.core import Document
 from medex.beagle import Beagle
+from medex.utils import read_json, write_json
 
 # Initialize Beagle
 beagle = Beagle("UPenn", "UPenn/page_importance_ranking.json")
 
 # Process each page file directly
 pages_dir = Path("UPenn/pages")
-page_files = list(pages_dir.glob("*.json"))
+with os.scandir(pages_dir) as entries:
+    page_files = [Path(entry.path) for entry in entries if entry.name.endswith(".json")]
 print(f"Found {len(page_files)} pages to analyze")
 
-for i, page_file in enumerate(page_files, 1):
-    print(f"\nProcessing page {i}/{len(page_files)}: {page_file.name}")
-    with open(page_file) as f:
-        page_data = json.load(f)
-        
-    # Create document from page content
-    document = Document(
-        text=page_data["content"],
-        metadata={"url": page_data["url"]}
-    )
-    
-    # Analyze page
-    analysis = beagle.analyze_page(document)
-    if analysis:
-        nodes = beagle.prepare_nodes(analysis, document)
-        
-        # Save analysis
-        output = {
-            "url": page_data["url"],
-            "analysis": analysis,
-            "nodes": [
-                {
-                    "text": node.text,
-                    "metadata": node.metadata
-                } for node in nodes
-            ],
-            "timestamp": page_data["timestamp"]
-        }
-        
-        output_path = f"UPenn/analysis/{page_file.stem}.json"
-        with open(output_path, "w") as f:
-            json.dump(output, f, indent=2)
+# Load every page up front, overlapping the disk reads
+with ThreadPoolExecutor(max_workers=8) as pool:
+    pages = list(pool.map(read_json, page_files))
+
+
+async def process(i, page_file, page_data, sem):
+    async with sem:
+        print(f"\nProcessing page {i}/{len(page_files)}: {page_file.name}")
+
+        # Create document from page content
+        document = Document(
+            text=page_data["content"],
+            metadata={"url": page_data["url"]}
+        )
+
+        # Analyze page off the event loop so other files keep moving
+        async with beagle.llm_limiter:
+            analysis = await asyncio.to_thread(beagle.analyze_page, document)
+        if analysis:
+            nodes = beagle.prepare_nodes(analysis, document)
+
+            # Save analysis
+            output = {
+                "url": page_data["url"],
+                "document_metadata": document.metadata,
+                "analysis": analysis,
+                "nodes": [
+                    {
+                        "text": node.text,
+                        "metadata": node.metadata
+                    } for node in nodes
+                ],
+                "timestamp": page_data["timestamp"]
+            }
+
+            output_path = f"UPenn/analysis/{page_file.stem}.json"
+            await asyncio.to_thread(write_json, output_path, output)
+
+
+async def main():
+    sem = asyncio.Semaphore(beagle.MAX_CONCURRENCY)
+    await asyncio.gather(*[
+        process(i, page_file, page_data, sem)
+        for i, (page_file, page_data) in enumerate(zip(page_files, pages), 1)
+    ])
+
+
+asyncio.run(main())
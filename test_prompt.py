@@ -1,13 +1,51 @@
-import json
+import asyncio
+import atexit
+import httpx
+import orjson
 import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import openai
+import tiktoken
 from dotenv import load_dotenv
+from medex.cache import AnalysisCache, SemanticCache
+from medex.utils import read_json, truncate_text, url_hash, write_json, StreamingJsonParser
 
 # Load environment variables
 load_dotenv()
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
+# One sync and one async client for the whole run, each over a single
+# keep-alive HTTP/2 pool, so requests skip the TCP+TLS handshake
+_api_limits = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+_api_timeout = httpx.Timeout(60.0, connect=5.0)
+_http = httpx.Client(http2=True, limits=_api_limits, timeout=_api_timeout)
+atexit.register(_http.close)
+# The SDK retries 429s, 5xx and connection errors itself, with jittered
+# exponential backoff that honors the server's retry-after header
+API_RETRIES = 6
+_client = openai.OpenAI(http_client=_http, max_retries=API_RETRIES)
+_aclient = openai.AsyncOpenAI(
+    http_client=httpx.AsyncClient(http2=True, limits=_api_limits, timeout=_api_timeout),
+    max_retries=API_RETRIES
+)
+MAX_CONCURRENCY = 8  # in-flight requests, to stay under the RPM limit
+MODEL = "gpt-4o-mini"
+_ENC = tiktoken.encoding_for_model(MODEL)
+MAX_PAGE_TOKENS = 6000  # per-page cap; longer pages are cut on a token boundary
+
+# PROMPT_TEST_BATCH_API=1 sends pages through the Batch API instead: half
+# the price and its own rate limits, but results can take up to 24 hours
+USE_BATCH_API = os.getenv("PROMPT_TEST_BATCH_API") == "1"
+BATCH_POLL_SECONDS = 30
+
+# Exact-match cache of analyses keyed on model, prompt and page content, so
+# re-running the suite only pays for pages or prompts that changed;
+# PROMPT_TEST_NOCACHE=1 always calls the API
+_cache = None if os.getenv("PROMPT_TEST_NOCACHE") == "1" else AnalysisCache("UPenn/prompt_tests/.cache")
+
 # New enhanced prompt
 ENHANCED_PROMPT = """"You are analyzing UPenn's medical school webpage. Your task is to extract and analyze ALL content from the main body of the page.
 
@@ -157,76 +195,332 @@ You must respond with a valid JSON object using this exact structure:
         "simple factors"
     ]
 }
+"""
 
-Content to analyze:
+# Per-page text goes only in the user message, after this label, so the
+# system message is a byte-identical prefix on every call and OpenAI's
+# automatic prompt caching bills it at the cached rate
+CONTENT_PREFIX = "Content to analyze:\n"
+
+# Opt-in (PROMPT_TEST_SEMANTIC_CACHE=1): template-sharing pages reuse the
+# analysis of the closest earlier page, kept per model and prompt version.
+# Off by default, since another page's answer scored as this page's result
+# invalidates a prompt evaluation
+EMBED_MODEL = "text-embedding-3-small"
+SIGNATURE_CHARS = 8000  # well inside the embedding model's input limit
+USE_SEMANTIC_CACHE = os.getenv("PROMPT_TEST_SEMANTIC_CACHE") == "1"
+_semantic_cache = None if _cache is None or not USE_SEMANTIC_CACHE else SemanticCache(
+    f"UPenn/prompt_tests/.semcache/{AnalysisCache.key(MODEL, ENHANCED_PROMPT)[:16]}",
+    threshold=0.92
+)
+
+# Prepended to the user message when several pages share one request, so
+# the system prompt stays identical across every call
+BATCH_PROMPT = """You are given {count} separate webpages below, numbered from 1, each starting with a <<<DOC n>>> line.
+Analyze each one independently. Return a single JSON object of the form {{"results": [...]}}
+whose first element is the analysis of DOC 1, second of DOC 2, and so on, each in the exact
+format described above.
 """
+BATCH_TOKEN_BUDGET = 6000  # page tokens packed into one request
+
+NOT_FOUND_RE = re.compile(r'"Page Not Found"|<h2>Page Not Found</h2>')
+NOT_FOUND_WINDOW = 8192
+
+NOT_FOUND_ANALYSIS = {
+    "sections": [{
+        "text": "Page Not Found",
+        "type": "error",
+        "context": "404 error page",
+        "data_points": {}
+    }]
+}
+
+def prepare_content(html_content):
+    """Clean a page for the prompt; returns None for 404 pages"""
+    # Check for 404 page; error templates put their markers near the top
+    # (title, heading) or bottom of the page, so only those windows are scanned
+    if (NOT_FOUND_RE.search(html_content, 0, NOT_FOUND_WINDOW)
+            or NOT_FOUND_RE.search(html_content, max(NOT_FOUND_WINDOW, len(html_content) - NOT_FOUND_WINDOW))):
+        print("Skipping 404 page")
+        return None
 
-def analyze_with_new_prompt(html_content):
-    """Analyze HTML content using the enhanced prompt"""
+    # Pages hold Explorer's already-extracted plain text, not HTML, so there
+    # is no markup to parse; just collapse whitespace runs
+    content = " ".join(html_content.split())
+    
+    tokens = _ENC.encode(content, disallowed_special=())
+    if len(tokens) > MAX_PAGE_TOKENS:
+        print(f"Large content detected ({len(tokens)} tokens). Truncating to {MAX_PAGE_TOKENS}.")
+        content = _ENC.decode(tokens[:MAX_PAGE_TOKENS])
+    return content
+
+def request_body(user_content):
+    """chat.completions parameters for one request"""
+    return {
+        "model": MODEL,
+        "messages": [
+            {"role": "system", "content": ENHANCED_PROMPT},
+            {"role": "user", "content": user_content}
+        ],
+        "temperature": 0,
+        # JSON mode: the reply is always a bare, parseable object
+        "response_format": {"type": "json_object"}
+    }
+
+async def stream_json(user_content):
+    """Stream a chat completion, stopping as soon as the JSON object closes.
+
+    Output that does not open with '{' aborts the stream on its first
+    token; the partial text is returned and fails to parse upstream.
+    """
+    parser = StreamingJsonParser()
+    stream = await _aclient.chat.completions.create(**request_body(user_content), stream=True)
     try:
-        # Check for 404 page
-        if '"Page Not Found"' in html_content or '<h2>Page Not Found</h2>' in html_content:
-            print("Skipping 404 page")
-            return {
-                "sections": [{
-                    "text": "Page Not Found",
-                    "type": "error",
-                    "context": "404 error page",
-                    "data_points": {}
-                }]
-            }
-
-        # Clean HTML content
-        html_content = html_content.replace('\n', ' ').replace('\r', ' ')
-        
-        # Estimate token count (rough estimate: 4 chars = 1 token)
-        estimated_tokens = len(html_content) / 4
-        
-        if estimated_tokens > 6000:
-            print(f"Large content detected ({estimated_tokens:.0f} estimated tokens). Splitting into chunks.")
-            # For now, just take the first 6000 tokens worth to test chunking logic
-            html_content = html_content[:24000]  # 24000 chars ≈ 6000 tokens
+        async for chunk in stream:
+            if chunk.choices and parser.consume(chunk.choices[0].delta.content or ""):
+                break
+    except ValueError as e:
+        print(f"Malformed response stream: {str(e)}")
+    finally:
+        await stream.close()
+    return parser.text
+
+async def analyze_with_new_prompt(html_contents):
+    """Analyze a group of cleaned pages using the enhanced prompt in one request.
+
+    Returns one analysis per page, in order, or None if the request failed;
+    malformed elements come back as None so the caller can retry them.
+    """
+    try:
+        if len(html_contents) == 1:
+            user_content = CONTENT_PREFIX + html_contents[0]
+        else:
+            user_content = BATCH_PROMPT.format(count=len(html_contents)) + "".join(
+                f"\n<<<DOC {n}>>>\n{html_content}\n" for n, html_content in enumerate(html_contents, 1)
+            )
         
-        client = openai.OpenAI()
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": ENHANCED_PROMPT},
-                {"role": "user", "content": html_content}
-            ],
-            temperature=0
-        )
+        text = await stream_json(user_content)
         
         try:
-            result = json.loads(response.choices[0].message.content)
-            return result
-        except json.JSONDecodeError as e:
+            result = orjson.loads(text)
+        except orjson.JSONDecodeError as e:
             print(f"JSON parsing error: {str(e)}")
-            print("Raw response:", response.choices[0].message.content[:200])
+            print("Raw response:", text[:200])
             return None
+        
+        if len(html_contents) == 1:
+            results = [result]
+        else:
+            results = result.get("results") if isinstance(result, dict) else None
+            if not isinstance(results, list) or len(results) != len(html_contents):
+                print(f"Expected {len(html_contents)} results, got {len(results) if isinstance(results, list) else 'none'}")
+                return None
+        return [analysis if is_valid_analysis(analysis) else None for analysis in results]
             
     except Exception as e:
         print(f"Error analyzing content: {str(e)}")
         return None
 
+def is_valid_analysis(analysis):
+    """Shape check before an analysis is cached or compared"""
+    if not isinstance(analysis, dict) or not isinstance(analysis.get("sections"), list):
+        return False
+    return all(
+        isinstance(section, dict)
+        and isinstance(section.get("text", ""), str)
+        and isinstance(section.get("data_points", {}), dict)
+        for section in analysis["sections"]
+    )
+
+def pack_batches(indexed_contents):
+    """Group (index, content) pairs into requests within BATCH_TOKEN_BUDGET"""
+    batches, batch, batch_tokens = [], [], 0
+    for index, content in indexed_contents:
+        tokens = len(_ENC.encode(content, disallowed_special=()))
+        if batch and batch_tokens + tokens > BATCH_TOKEN_BUDGET:
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append((index, content))
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def _cache_key(content):
+    return AnalysisCache.key(MODEL, ENHANCED_PROMPT, content)
+
+def _resolve_locally(html_contents):
+    """Answer 404 pages and cache hits without the API.
+
+    Returns (results, [(index, cleaned content)] still to analyze).
+    """
+    results = [None] * len(html_contents)
+    pending = []
+    for index, html_content in enumerate(html_contents):
+        content = prepare_content(html_content)
+        if content is None:
+            results[index] = NOT_FOUND_ANALYSIS
+            continue
+        cached = _cache.get(_cache_key(content)) if _cache else None
+        if cached is not None:
+            print(f"Cache hit for page {index}")
+            results[index] = cached
+        else:
+            pending.append((index, content))
+    return results, pending
+
+def page_signature(content):
+    """Leading text of a cleaned page, for embedding"""
+    return truncate_text(content, SIGNATURE_CHARS)
+
+async def _resolve_similar(results, pending):
+    """Answer near-duplicates of already analyzed pages from the semantic cache.
+
+    Returns the pages still to analyze and their embeddings by index.
+    """
+    if _semantic_cache is None or not pending:
+        return pending, {}
+    try:
+        response = await _aclient.embeddings.create(
+            model=EMBED_MODEL,
+            input=[page_signature(content) for _, content in pending]
+        )
+    except Exception as e:
+        print(f"Error embedding pages: {str(e)}")
+        return pending, {}
+    
+    remaining, embeddings = [], {}
+    for (index, content), item in zip(pending, response.data):
+        cached = _semantic_cache.get(item.embedding)
+        if cached is not None:
+            print(f"Semantic cache hit for page {index}")
+            results[index] = cached
+        else:
+            remaining.append((index, content))
+            embeddings[index] = item.embedding
+    return remaining, embeddings
+
+def _remember(content, analysis, embedding=None):
+    if _cache and analysis is not None:
+        _cache.put(_cache_key(content), analysis)
+        if embedding is not None:
+            _semantic_cache.put(embedding, analysis)
+
+async def _run_all(html_contents):
+    """Analyze all pages in as few requests as fit the token budget, sending
+    the requests concurrently, bounded by MAX_CONCURRENCY"""
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    results, pending = _resolve_locally(html_contents)
+    pending, embeddings = await _resolve_similar(results, pending)
+
+    async def bounded(batch):
+        async with sem:
+            analyses = await analyze_with_new_prompt([content for _, content in batch])
+        analyses = analyses or [None] * len(batch)
+        for (index, content), analysis in zip(batch, analyses):
+            results[index] = analysis
+            _remember(content, analysis, embeddings.get(index))
+        # Pages whose batched answer failed or was malformed are retried alone
+        if len(batch) > 1:
+            await asyncio.gather(*[
+                bounded([page]) for page, analysis in zip(batch, analyses) if analysis is None
+            ])
+
+    await asyncio.gather(*[bounded(batch) for batch in pack_batches(pending)])
+    return results
+
+def submit_batch(requests):
+    """Run pages through the OpenAI Batch API and wait for the results.
+
+    Takes {custom_id: cleaned content}; returns {custom_id: analysis}.
+    """
+    lines = b"\n".join(
+        orjson.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": request_body(CONTENT_PREFIX + content)
+        })
+        for custom_id, content in requests.items()
+    )
+    input_file = _client.files.create(file=("prompt_tests.jsonl", lines), purpose="batch")
+    batch = _client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    print(f"Submitted batch {batch.id} with {len(requests)} pages")
+    
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(BATCH_POLL_SECONDS)
+        batch = _client.batches.retrieve(batch.id)
+    if batch.status != "completed" or not batch.output_file_id:
+        print(f"Batch {batch.id} ended with status {batch.status}")
+        return {}
+    
+    results = {}
+    for line in _client.files.content(batch.output_file_id).text.splitlines():
+        record = orjson.loads(line)
+        try:
+            content = record["response"]["body"]["choices"][0]["message"]["content"]
+            analysis = orjson.loads(content)
+            if is_valid_analysis(analysis):
+                results[record["custom_id"]] = analysis
+            else:
+                print(f"Malformed analysis in batch result for {record.get('custom_id')}")
+        except (KeyError, IndexError, TypeError, orjson.JSONDecodeError) as e:
+            print(f"Error in batch result for {record.get('custom_id')}: {str(e)}")
+    return results
+
+def _run_batch_api(html_contents):
+    """Batch API counterpart of _run_all: one request line per page"""
+    results, pending = _resolve_locally(html_contents)
+    pending, embeddings = asyncio.run(_resolve_similar(results, pending))
+    requests = {str(index): content for index, content in pending}
+    
+    if requests:
+        for custom_id, analysis in submit_batch(requests).items():
+            results[int(custom_id)] = analysis
+            _remember(requests[custom_id], analysis, embeddings.get(int(custom_id)))
+    return results
+
+PREVIEW_CHARS = 100
+
+def _preview(text, limit=PREVIEW_CHARS, ellipsis="..."):
+    """First `limit` characters of text, with an ellipsis only if it was cut"""
+    return text[:limit] + ellipsis if len(text) > limit else text
+
 def compare_analyses(old_analysis, new_analysis):
     """Compare old and new analyses to highlight differences"""
-    differences = {
-        "content_depth": len(str(new_analysis)) - len(str(old_analysis)),
-        "section_count": len(new_analysis.get("sections", [])) - len(old_analysis.get("sections", [])),
-        "has_data_points": "data_points" in new_analysis.get("sections", [{}])[0],
-        "meta_only": all("meta" in s.get("context", "").lower() for s in old_analysis.get("sections", [])),
-        "old_sections": [{
+    old_secs = old_analysis.get("sections") or []
+    new_secs = new_analysis.get("sections") or []
+    
+    # One pass over each side's sections
+    old_sections = []
+    meta_only = True
+    for s in old_secs:
+        meta_only = meta_only and "meta" in s.get("context", "").lower()
+        old_sections.append({
             "type": s.get("type"),
             "context": s.get("context"),
-            "text_preview": s.get("text", "")[:100] + "..."
-        } for s in old_analysis.get("sections", [])],
-        "new_sections": [{
-            "type": s.get("type"),
-            "context": s.get("context"),
-            "text_preview": s.get("text", "")[:100] + "...",
-            "data_points": {k: v for k, v in s.get("data_points", {}).items() if v}
-        } for s in new_analysis.get("sections", [])]
+            "text_preview": _preview(s.get("text", ""))
+        })
+    
+    new_sections = [{
+        "type": s.get("type"),
+        "context": s.get("context"),
+        "text_preview": _preview(s.get("text", "")),
+        "data_points": {k: v for k, v in s.get("data_points", {}).items() if v}
+    } for s in new_secs]
+    
+    differences = {
+        # Serialized size difference in UTF-8 bytes; orjson encodes in C instead of repr()
+        "content_depth": len(orjson.dumps(new_analysis)) - len(orjson.dumps(old_analysis)),
+        "section_count": len(new_secs) - len(old_secs),
+        "has_data_points": bool(new_secs) and "data_points" in new_secs[0],
+        "meta_only": meta_only,
+        "old_sections": old_sections,
+        "new_sections": new_sections
     }
     return differences
 
@@ -239,40 +533,48 @@ def test_prompt():
     results = []
 
     # Test final pages
-    test_files = [
-        "88c4f4b44e10f87f6e628b9d50c51ae2.json",  # Core curriculum page
-        "461b5aa786b8dd92eb0199a8d10deecd.json"   # Application timeline page
+    # Test pages by URL; files are named by url_hash, as Explorer and Beagle
+    # write them (run rename_legacy_files.py once for MD5-named crawls)
+    test_urls = [
+        "https://www.med.upenn.edu/admissions/technical-standards.html",
+        "https://www.med.upenn.edu/admissions/applications-timeline.html"
     ]
-
-    for filename in test_files:
-        page_path = pages_dir / filename
-        analysis_path = analyses_dir / filename
-        
-        if not page_path.exists() or not analysis_path.exists():
-            continue
-
+    test_files = [f"{url_hash(url)}.json" for url in test_urls]
+
+    # Load every test page first so the analyses can run concurrently
+    present = []
+    for url, filename in zip(test_urls, test_files):
+        if (pages_dir / filename).exists() and (analyses_dir / filename).exists():
+            present.append(filename)
+        else:
+            print(f"Missing page or analysis for {url} ({filename}); skipping")
+    
+    # Overlap the page and old-analysis reads on a thread pool
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        pages = pool.map(read_json, [pages_dir / filename for filename in present])
+        old_analyses = pool.map(read_json, [analyses_dir / filename for filename in present])
+        loaded = list(zip(present, pages, old_analyses))
+
+    # Run new analyses
+    html_contents = [page_data["content"] for _, page_data, _ in loaded]
+    if USE_BATCH_API:
+        new_analyses = _run_batch_api(html_contents)
+    else:
+        new_analyses = asyncio.run(_run_all(html_contents))
+
+    for (filename, page_data, old_analysis), new_analysis in zip(loaded, new_analyses):
         print(f"\nTesting {filename}...")
-        
-        # Load files
-        with open(page_path) as f:
-            page_data = json.load(f)
-        with open(analysis_path) as f:
-            old_analysis = json.load(f)
-
-        # Run new analysis
-        new_analysis = analyze_with_new_prompt(page_data["content"])
         if not new_analysis:
             continue
 
         # Save new analysis
         if new_analysis:
             output_path = output_dir / f"test_{filename}"
-            with open(output_path, 'w') as f:
-                json.dump({
-                    "url": page_data.get("url", ""),
-                    "analysis": new_analysis,
-                    "timestamp": page_data.get("timestamp", "")
-                }, f, indent=2)
+            write_json(output_path, {
+                "url": page_data.get("url", ""),
+                "analysis": new_analysis,
+                "timestamp": page_data.get("timestamp", "")
+            })
             print(f"\nSaved test results to: {output_path}")
 
         # Compare results
@@ -304,7 +606,7 @@ def test_prompt():
                         print(f"  {k}: {v}")
         
         print("\nSUMMARY:")
-        print(f"Content depth change: {differences['content_depth']} characters")
+        print(f"Content depth change: {differences['content_depth']} bytes of JSON")
         print(f"Section count change: {differences['section_count']}")
         print(f"Has data points: {differences['has_data_points']}")
         print(f"Old analysis was meta-only: {differences['meta_only']}")
@@ -314,6 +616,8 @@ def test_prompt():
 if __name__ == "__main__":
     print("Testing enhanced prompt...")
     results = test_prompt()
+    if not results:
+        raise SystemExit("No test pages were analyzed; check the test URLs and UPenn/pages")
     print("\nOverall Results:")
     improved_count = sum(1 for r in results if r["improved"])
     print(f"{improved_count}/{len(results)} pages showed improvement")
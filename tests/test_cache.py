@@ -0,0 +1,107 @@
+import os
+import time
+
+import numpy as np
+from llama_index.core.embeddings import MockEmbedding
+
+from medex import cache as cache_module
+from medex.cache import AnalysisCache, CachedEmbedding, MinHashIndex, SemanticCache
+
+
+def test_analysis_cache_round_trip(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    key = AnalysisCache.key("gpt-4o-mini", "prompt", "page text")
+    assert cache.get(key) is None
+    cache.put(key, {"importance_score": 0.9})
+    assert cache.get(key) == {"importance_score": 0.9}
+    # A fresh instance reads the entry back from disk
+    assert AnalysisCache(str(tmp_path)).get(key) == {"importance_score": 0.9}
+
+
+def test_analysis_cache_key_depends_on_every_part():
+    assert AnalysisCache.key("a", "b") == AnalysisCache.key("a", "b")
+    assert AnalysisCache.key("a", "b") != AnalysisCache.key("a", "c")
+
+
+def test_analysis_cache_ttl_expiry(tmp_path):
+    AnalysisCache(str(tmp_path)).put("k", {"v": 1})
+    old = time.time() - 3600
+    os.utime(tmp_path / "k.json", (old, old))
+    assert AnalysisCache(str(tmp_path), ttl=60).get("k") is None
+    assert AnalysisCache(str(tmp_path), ttl=7200).get("k") == {"v": 1}
+
+
+def test_semantic_cache_returns_most_similar_entry(tmp_path):
+    cache = SemanticCache(str(tmp_path), threshold=0.9)
+    cache.put([1.0, 0.0, 0.0], {"name": "x"})
+    cache.put([0.0, 1.0, 0.0], {"name": "y"})
+    cache.put([0.7, 0.7, 0.0], {"name": "xy"})
+    # Scores survive int8 quantization in the right order
+    assert cache.get([0.99, 0.05, 0.0]) == {"name": "x"}
+    assert cache.get([0.05, 0.99, 0.0]) == {"name": "y"}
+    assert cache.get([0.6, 0.75, 0.0]) == {"name": "xy"}
+    assert cache.get([0.0, 0.0, 1.0]) is None
+
+
+def test_semantic_cache_reloads_from_disk(tmp_path):
+    SemanticCache(str(tmp_path)).put([0.0, 1.0], {"name": "y"})
+    assert SemanticCache(str(tmp_path)).get([0.0, 1.0]) == {"name": "y"}
+
+
+def test_semantic_cache_ttl_expiry(tmp_path, monkeypatch):
+    cache = SemanticCache(str(tmp_path), ttl=60)
+    monkeypatch.setattr(cache_module.time, "time", lambda: 1000.0)
+    cache.put([1.0, 0.0], {"name": "x"})
+    monkeypatch.setattr(cache_module.time, "time", lambda: 1030.0)
+    assert cache.get([1.0, 0.0]) == {"name": "x"}
+    monkeypatch.setattr(cache_module.time, "time", lambda: 1100.0)
+    assert cache.get([1.0, 0.0]) is None
+
+
+def test_semantic_cache_scope(tmp_path):
+    cache = SemanticCache(str(tmp_path))
+    cache.put([1.0, 0.0], {"name": "a"}, scope="https://s.edu/a")
+    assert cache.get([1.0, 0.0], scope="https://s.edu/a") == {"name": "a"}
+    assert cache.get([1.0, 0.0], scope="https://s.edu/b") is None
+    assert cache.get([1.0, 0.0]) is None
+    assert SemanticCache(str(tmp_path)).get([1.0, 0.0], scope="https://s.edu/a") == {"name": "a"}
+
+
+def test_minhash_matches_near_duplicates_only():
+    index = MinHashIndex(threshold=0.8)
+    base = " ".join(f"word{i}" for i in range(200))
+    index.put(index.signature(base), {"name": "base"})
+    assert index.get(index.signature(base + " extra")) == {"name": "base"}
+    other = " ".join(f"other{i}" for i in range(200))
+    assert index.get(index.signature(other)) is None
+
+
+def test_minhash_skips_texts_shorter_than_shingle_width():
+    index = MinHashIndex(shingle_size=5)
+    for text in ["", "Redirecting", "one two three four five six seven eight"]:
+        assert index.signature(text) is None
+    index.put(None, {"name": "stub"})
+    assert index.get(index.signature("")) is None
+
+
+class CountingEmbedding(MockEmbedding):
+    calls: int = 0
+
+    def _get_text_embeddings(self, texts):
+        self.calls += 1
+        return super()._get_text_embeddings(texts)
+
+
+def test_cached_embedding_round_trip(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    inner = CountingEmbedding(embed_dim=4)
+    embed = CachedEmbedding(inner, path)
+    first = embed.get_text_embedding_batch(["a", "b"])
+    assert inner.calls == 1
+    assert embed.get_text_embedding_batch(["b", "a"]) == [first[1], first[0]]
+    assert inner.calls == 1
+    # Persisted, and only misses reach the wrapped model
+    again = CachedEmbedding(inner, path)
+    again.get_text_embedding_batch(["a", "c"])
+    assert inner.calls == 2
+    assert np.allclose(again.get_text_embedding("a"), first[0])
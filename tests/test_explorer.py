@@ -0,0 +1,58 @@
+import pytest
+
+from medex.explorer import Explorer
+
+
+@pytest.fixture
+def explorer():
+    # Only the URL and parsing helpers are exercised; no crawl state needed
+    explorer = Explorer.__new__(Explorer)
+    explorer.base_domain = "s.edu"
+    explorer._start_path = "/adm/"
+    explorer.MAX_PROMPT_CHARS = 2000
+    return explorer
+
+
+@pytest.mark.parametrize("a, b", [
+    ("https://s.edu/adm/?b=2&a=1", "https://s.edu/adm?a=1&b=2"),
+    ("https://s.edu/adm/page.html#apply", "https://s.edu/adm/page.html"),
+    ("HTTPS://S.EDU:443/adm/", "https://s.edu/adm"),
+    ("http://s.edu:80", "http://s.edu/"),
+])
+def test_normalize_url_equivalent_spellings(a, b):
+    assert Explorer.normalize_url(a) == Explorer.normalize_url(b)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("https://s.edu/adm?a=1", "https://s.edu/adm?a=2"),
+    ("https://s.edu/adm", "https://s.edu/ADM"),
+    ("http://s.edu/adm", "https://s.edu/adm"),
+    ("https://s.edu:8443/adm", "https://s.edu/adm"),
+])
+def test_normalize_url_distinct_urls(a, b):
+    assert Explorer.normalize_url(a) != Explorer.normalize_url(b)
+
+
+def test_is_valid_url_rejects_non_strings(explorer):
+    assert explorer.is_valid_url("https://s.edu/adm/apply.html")
+    assert not explorer.is_valid_url("https://other.edu/adm/apply.html")
+    for url in (["https://s.edu/adm/"], 5, None):
+        assert not explorer.is_valid_url(url)
+
+
+def test_page_document_skips_malformed_hrefs(explorer):
+    html = (
+        '<html><title>Admissions</title><body>'
+        '<a href="http://[">bad</a><a href="/adm/apply.html#top">Apply</a>'
+        '<a href="https://other.edu/">Elsewhere</a><p>Welcome</p></body></html>'
+    )
+    document = explorer._page_document("https://s.edu/adm/", html)
+    assert document.metadata["links"] == [{"url": "https://s.edu/adm/apply.html", "text": "Apply"}]
+    assert "Welcome" in document.text
+
+
+def test_page_links_stay_out_of_embed_and_llm_metadata(explorer):
+    links = "".join(f'<a href="/adm/p{i}.html">Page {i}</a>' for i in range(300))
+    document = explorer._page_document("https://s.edu/adm/", f"<html><body>{links}</body></html>")
+    assert "links" in document.excluded_embed_metadata_keys
+    assert "links" in document.excluded_llm_metadata_keys
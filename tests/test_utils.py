@@ -0,0 +1,51 @@
+import orjson
+import pytest
+
+from medex.utils import StreamingJsonParser, truncate_text, url_hash
+
+
+def feed(parser, chunks):
+    for chunk in chunks:
+        if parser.consume(chunk):
+            return True
+    return False
+
+
+def test_parser_complete_stream_stops_at_closing_brace():
+    parser = StreamingJsonParser()
+    assert feed(parser, ['  {"a": ', '[1, {"b": "}"}', ']}', ' trailing']) is True
+    assert parser.complete
+    assert orjson.loads(parser.text) == {"a": [1, {"b": "}"}]}
+
+
+def test_parser_handles_escaped_quotes():
+    parser = StreamingJsonParser()
+    assert feed(parser, ['{"a": "say \\"hi\\" }"', '}']) is True
+    assert orjson.loads(parser.text) == {"a": 'say "hi" }'}
+
+
+def test_parser_incomplete_stream():
+    parser = StreamingJsonParser()
+    assert feed(parser, ['{"a": [1, 2', ', 3']) is False
+    assert not parser.complete
+
+
+def test_parser_rejects_non_object_output():
+    with pytest.raises(ValueError):
+        StreamingJsonParser().consume("Sure! Here is the JSON")
+
+
+def test_parser_rejects_mismatched_brackets():
+    with pytest.raises(ValueError):
+        feed(StreamingJsonParser(), ['{"a": [1}'])
+
+
+def test_truncate_text_backs_up_to_word_boundary():
+    assert truncate_text("short", 10) == "short"
+    assert truncate_text("hello wonderful world", 12) == "hello"
+
+
+def test_url_hash_is_stable_and_distinct():
+    assert url_hash("https://s.edu/a") == url_hash("https://s.edu/a")
+    assert url_hash("https://s.edu/a") != url_hash("https://s.edu/b")
+    assert len(url_hash("https://s.edu/a")) == 32